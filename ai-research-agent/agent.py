@@ -1,21 +1,20 @@
 import os
-import shutil
 import sys
+from datetime import datetime, timezone
 
-import yaml
 from dotenv import load_dotenv
-from podcastfy.client import generate_podcast
+from email_store import day_notes, load_cursor, load_day, mark_podcast_queued, save_cursor
 from portia import (
     Config,
     DefaultToolRegistry,
     LogLevel,
     PlanRunState,
     Portia,
-    Tool,
-    ToolRunContext,
 )
 from portia.cli import CLIExecutionHooks
+from podcast_jobs import mark_posted, queue_job, run_job, unfinished_jobs
 from pydantic import BaseModel, Field
+from summarise import SummariseEmailsTool
 
 load_dotenv()
 
@@ -27,99 +26,55 @@ class ResearchAgentOutput(BaseModel):
     )
 
 
-class PodcastToolSchema(BaseModel):
-    """Input for PodcastTool."""
+def create_portia() -> Portia:
+    """Create the Portia instance (and its tool registry) used to run the agent.
 
-    summary: str = Field(
-        ...,
-        description=("The high-level summary for the podcast."),
-    )
-    details: str = Field(
-        ..., description=("Further details that can be used in creating the podcast.")
-    )
-
-
-class PodcastTool(Tool[str]):
-    """Create a podcast based on a high-level summary and further details."""
-
-    id: str = "podcast_tool"
-    name: str = "Podcast Tool"
-    description: str = (
-        "Used to create a podcast based on a high-level summary and further details."
-    )
-    args_schema: type[BaseModel] = PodcastToolSchema
-    output_schema: tuple[str, str] = (
-        "str",
-        "The location of the output audio file.",
-    )
-
-    def run(self, _: ToolRunContext, summary: str, details: str) -> str:
-        """Run the Podcast Tool."""
-
-        config_path = os.path.join(
-            os.path.dirname(__file__), "conversation_config.yaml"
-        )
-        with open(config_path) as config_file:
-            conversation_config = yaml.safe_load(config_file)
-
-        if os.getenv("GEMINI_API_KEY"):
-            llm_model_name = "gemini-1.5-pro-latest"
-            api_key_label = "GEMINI_API_KEY"
-            tts_model = "gemini"
-            # If your GCP project has had multi-speaker allowlisted, you can use this instead:
-            # tts_model = "geminimulti"
-        else:
-            llm_model_name = "gpt-4o"
-            api_key_label = "OPENAI_API_KEY"
-            tts_model = "openai"
-
-        audio_file = generate_podcast(
-            text=f"A summary of today's AI news is given by: {summary}\n\nDiving deeper, here are the full details: {details}",
-            llm_model_name=llm_model_name,
-            api_key_label=api_key_label,
-            conversation_config=conversation_config,
-            tts_model=tts_model,
-        )
-
-        # Copy the audio file to a standard location for the latest podcast
-        latest_podcast_path = os.path.join(
-            os.path.dirname(__file__), "data", "audio", "podcast_latest.mp3"
-        )
-        shutil.copy2(audio_file, latest_podcast_path)
-
-        return latest_podcast_path
-
-
-def run_agent() -> ResearchAgentOutput:
-    """Run the AI research agent."""
+    This is comparatively slow, so long-running processes (see `discord_bot.py --daemon`) create
+    it once and reuse it for each run.
+    """
     config = Config.from_default(
         default_model="openai/gpt-4o",
         default_log_level=LogLevel.DEBUG,
     )
-    tools = DefaultToolRegistry(config) + [PodcastTool()]
-    portia = Portia(
+    tools = DefaultToolRegistry(config) + [SummariseEmailsTool()]
+    return Portia(
         config=config,
         tools=tools,
         execution_hooks=CLIExecutionHooks(),
     )
 
+
+def run_agent(
+    portia: Portia | None = None, confirm_plan: bool | None = None
+) -> ResearchAgentOutput:
+    """Run the AI research agent.
+
+    If `confirm_plan` is true, the user is asked to approve the plan before it's run. By default
+    they're asked unless running in CI.
+    """
+    if portia is None:
+        portia = create_portia()
+    if confirm_plan is None:
+        confirm_plan = os.getenv("CI") != "true"
+
+    # Only the emails that have arrived since the last run are read, and folded into today's
+    # summary so far (see email_store.py)
+    started = datetime.now(timezone.utc)
+    cursor = load_cursor()
+
     # We plan and run the agent in separate steps so we can print out the plan.
     # An alternative would be to just call portia.run() which will do both.
+    # The plan is made afresh for each run, as it refers to the emails since the last run.
     plan = portia.plan(
-        "Read all emails from today that contain 'AI'. If there are no emails, exit. "
-        "If there are emails, summarise them into a single, coherent summary (i.e. don't summarise each email separately). "
-        "The summary should be focussed on 3 key themes, with each having a text summary and then a bullet-pointed list (up to 3 bullets) associated with each theme with web pages (title + link) for people to investigate further. "
-        "The heading should be 'Daily AI News Update' and the summary should be in a format suitable for sending on slack / discord (i.e. no markdown formatting)."
-        "For this step, when calling the llm_tool, use templating to pass the emails in (rather than copying them verbatim)."
+        f"Read all emails that match the Gmail search query 'AI after:{int(cursor.timestamp())}' (i.e. the emails containing 'AI' received since {cursor:%Y-%m-%d %H:%M} UTC). If there are no emails, exit. "
+        "If there are emails, summarise them with the summarise emails tool, using templating to pass the emails in (rather than copying them verbatim). "
         "Then post the summary with links to the slack channel with ID C08D31BNFGV. "
-        "Then, create a short podcast based on the emails, driven by the summary but with further details coming from the emails. "
-        "For this step, when calling the podcast tool, use templating to pass the emails in (rather than copying them verbatim)."
     )
 
     print("\nHere are the steps in the generated plan:")
     print(plan.pretty_print())
 
-    if os.getenv("CI") != "true":
+    if confirm_plan:
         user_input = input("Are you happy with the plan? (y/n):\n")
         if user_input != "y":
             sys.exit(1)
@@ -133,8 +88,23 @@ def run_agent() -> ResearchAgentOutput:
         raise Exception(
             f"Plan run failed with state {run.state}. Check logs for details."
         )
-    return ResearchAgentOutput.model_validate(run.outputs.final_output.value)
+    output = ResearchAgentOutput.model_validate(run.outputs.final_output.value)
+    save_cursor(started)
+
+    # The podcast takes a while to create, so it's made in the background (see podcast_jobs.py)
+    # after the summary has been posted, with the notes on the emails giving the details. Whether
+    # it's been queued is kept with the summary, so that if a run fails after the summary has been
+    # saved, the next run still queues it.
+    day = load_day()
+    if day["summary"] and not day.get("podcast_queued"):
+        queue_job(output.new_post_text or day["summary"], "\n\n".join(day_notes()))
+        mark_podcast_queued()
+    return output
 
 
 if __name__ == "__main__":
     run_agent()
+    # Create the podcast before exiting, so that the Github Action can post it to slack
+    for job in unfinished_jobs():
+        if run_job(job).status == "done":
+            mark_posted(job)
@@ -1,42 +1,121 @@
+import argparse
 import asyncio
 import os
 
 import discord
-from agent import run_agent
+from agent import create_portia, run_agent
 from dotenv import load_dotenv
+from podcast_jobs import mark_posted, run_job, unfinished_jobs
+from scheduler import Scheduler
 
 load_dotenv(override=True)
 bot = discord.Bot()
 
+parser = argparse.ArgumentParser(description="Run the AI research agent and post to discord.")
+parser.add_argument(
+    "--daemon",
+    action="store_true",
+    help="Stay connected and run the agent on a schedule, rather than running it once and exiting",
+)
+parser.add_argument(
+    "--schedule",
+    action="append",
+    help="A cron schedule (in UTC) for daemon mode, e.g. '0 17 * * *'. Can be given more than "
+    "once. Defaults to the schedules in AGENT_SCHEDULES (separated by ';'), or 5pm daily.",
+)
+args = parser.parse_args()
+schedules = args.schedule or [
+    schedule.strip()
+    for schedule in os.getenv("AGENT_SCHEDULES", "0 17 * * *").split(";")
+    if schedule.strip()
+]
+
+# Discord can call on_ready again after reconnecting, so only start the scheduler once
+scheduler_task: asyncio.Task | None = None
+# Only one coroutine processes the podcast jobs at a time, so that a job isn't run twice
+podcast_lock = asyncio.Lock()
+# Keep references to background tasks, so they aren't garbage collected before they finish
+podcast_tasks: set[asyncio.Task] = set()
+
+
+async def post_summary(result):
+    """Send the summary to the discord channel."""
+    channel_id = int(os.getenv("DISCORD_CHANNEL_ID"))
+    channel = bot.get_channel(channel_id)
+    if not channel:
+        print(f"Channel with ID {channel_id} not found")
+        return
+
+    # Split message on blank lines - we do this so we don't exceed the maximum message length
+    message_parts = [
+        part.strip() for part in result.new_post_text.split("\n\n") if part.strip()
+    ]
+    for part in message_parts:
+        await channel.send(part)
+
+
+async def post_podcasts():
+    """Create the podcasts that haven't been posted yet, and send them to the discord channel.
+
+    This includes any that were interrupted by the bot being restarted.
+    """
+    loop = asyncio.get_running_loop()
+    channel_id = int(os.getenv("DISCORD_CHANNEL_ID"))
+    async with podcast_lock:
+        for job in await loop.run_in_executor(None, unfinished_jobs):
+            job = await loop.run_in_executor(None, run_job, job)
+            channel = bot.get_channel(channel_id)
+            if job.status != "done" or not channel:
+                continue
+            file = discord.File(job.audio_path, filename="ai_news_podcast.mp3")
+            await channel.send("Also available as a podcast below - enjoy!", file=file)
+            mark_posted(job)
+
+
+async def run_and_post(portia=None, confirm_plan=None, background_podcast=False):
+    loop = asyncio.get_running_loop()
+    # Run the agent in a thread to avoid blocking the event loop
+    result = await loop.run_in_executor(None, run_agent, portia, confirm_plan)
+    # Post the summary as soon as we have it, then follow up with the podcast
+    await post_summary(result)
+    if background_podcast:
+        podcast_tasks.add(task := asyncio.create_task(post_podcasts()))
+        task.add_done_callback(podcast_tasks.discard)
+    else:
+        await post_podcasts()
+
+
+async def run_daemon():
+    loop = asyncio.get_running_loop()
+    try:
+        # Create Portia (and its tool registry) once, rather than for every run
+        portia = await loop.run_in_executor(None, create_portia)
+    except Exception as e:
+        print(f"Failed to set up the agent: {e}")
+        await bot.close()
+        return
+
+    scheduler = Scheduler()
+    scheduler.add_job(
+        "ai-research-agent",
+        schedules,
+        lambda: run_and_post(portia, confirm_plan=False, background_podcast=True),
+    )
+    # Finish off any podcasts that were interrupted by a restart
+    await asyncio.gather(post_podcasts(), scheduler.run_forever())
+
 
 @bot.event
 async def on_ready():
+    global scheduler_task
     print(f"{bot.user} is ready and online!")
+    if args.daemon:
+        if scheduler_task is None:
+            scheduler_task = asyncio.create_task(run_daemon())
+        return
     try:
-        # Run the agent in a thread to avoid blocking the event loop
-        result = await asyncio.get_event_loop().run_in_executor(None, run_agent)
-
-        # Send Discord message with podcast
-        channel_id = int(os.getenv("DISCORD_CHANNEL_ID"))
-        channel = bot.get_channel(channel_id)
-        podcast_path = os.path.join(
-            os.path.dirname(__file__), "data", "audio", "podcast_latest.mp3"
-        )
-        if channel and os.path.exists(podcast_path):
-            file = discord.File(podcast_path, filename="ai_news_podcast.mp3")
-
-            # Split message on blank lines - we do this so we don't exceed the maximum message length
-            message_parts = [
-                part.strip()
-                for part in result.new_post_text.split("\n\n")
-                if part.strip()
-            ]
-            for part in message_parts:
-                await channel.send(part)
-
-            await channel.send("Also available as a podcast below - enjoy!", file=file)
-        else:
-            print(f"Channel with ID {channel_id} not found")
+        # This also finishes off any podcasts from previous runs that were interrupted
+        await run_and_post()
     except Exception as e:
         print(f"Agent failed: {e}")
     finally:
@@ -0,0 +1,97 @@
+"""The local store of the emails that have been summarised, and the cursor for fetching new ones.
+
+Each run of the agent only fetches the emails that have arrived since the last successful run,
+and folds them into the summary of the day so far, so the agent can be rerun during the day
+(e.g. on several schedules) without summarising the whole inbox again. Under `data/`:
+- `email_notes.json`: the notes taken on each email, by message ID.
+- `days/<date>.json`: the IDs of the emails summarised on each day (in UTC), the summary, and
+  whether a podcast of the summary has been queued.
+- `cursor.json`: when the last successful run started.
+"""
+
+import json
+import os
+from datetime import date, datetime, time, timezone
+from typing import Any
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+NOTES_PATH = os.path.join(DATA_DIR, "email_notes.json")
+DAYS_DIR = os.path.join(DATA_DIR, "days")
+CURSOR_PATH = os.path.join(DATA_DIR, "cursor.json")
+
+
+def _load_json(path: str, default: Any) -> Any:
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path: str, value: Any):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(value, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _day_path(day: date | None) -> str:
+    return os.path.join(DAYS_DIR, f"{(day or _today()).isoformat()}.json")
+
+
+def load_notes() -> dict[str, str]:
+    """Notes on each email that has been summarised, by message ID."""
+    return _load_json(NOTES_PATH, {})
+
+
+def save_notes(notes: dict[str, str]):
+    _save_json(NOTES_PATH, notes)
+
+
+def load_day(day: date | None = None) -> dict[str, Any]:
+    """The emails summarised on a day (by default today) and their summary, if any."""
+    return _load_json(
+        _day_path(day), {"message_ids": [], "summary": None, "podcast_queued": False}
+    )
+
+
+def save_day(message_ids: list[str], summary: str | None, day: date | None = None):
+    previous = load_day(day)
+    # A new summary needs a new podcast
+    podcast_queued = previous.get("podcast_queued", False) and previous["summary"] == summary
+    _save_json(
+        _day_path(day),
+        {"message_ids": message_ids, "summary": summary, "podcast_queued": podcast_queued},
+    )
+
+
+def mark_podcast_queued(day: date | None = None):
+    """Record that a podcast of the day's current summary has been queued."""
+    _save_json(_day_path(day), {**load_day(day), "podcast_queued": True})
+
+
+def day_notes(day: date | None = None) -> list[str]:
+    """The notes on the emails summarised on a day (by default today)."""
+    notes = load_notes()
+    message_ids = load_day(day)["message_ids"]
+    return [notes[message_id] for message_id in message_ids if notes.get(message_id)]
+
+
+def load_cursor() -> datetime:
+    """Emails received after this time haven't been summarised yet.
+
+    This is the start of the last successful run, or the start of today if there's been no run
+    today, as each day's summary starts afresh.
+    """
+    start_of_today = datetime.combine(_today(), time(), tzinfo=timezone.utc)
+    cursor = _load_json(CURSOR_PATH, {}).get("last_run")
+    if cursor is None:
+        return start_of_today
+    return max(datetime.fromisoformat(cursor), start_of_today)
+
+
+def save_cursor(last_run: datetime):
+    _save_json(CURSOR_PATH, {"last_run": last_run.isoformat()})
@@ -0,0 +1,172 @@
+"""Resolving the links in the emails to the titles of the pages they point to.
+
+The summary lists web pages (title + link) under each theme. Rather than having the LLM guess
+the titles from the emails, the links are taken from the emails, canonicalised (dropping
+tracking parameters and fragments) and deduplicated, and the titles are fetched concurrently
+with a pooled HTTP client. Newsletters tend to wrap links in redirects for click tracking, so
+redirects are followed and the page's final URL is used as its link. Redirects are followed one
+at a time, so that a tracking link that leads to an unsubscribe link isn't followed through.
+
+Responses are cached in `data/link_cache.json`. Cached pages are revalidated with their ETag or
+Last-Modified date, so unchanged pages cost a `304 Not Modified` rather than a full download,
+and pages without either are only fetched again once the cached copy is `LINK_CACHE_DAYS` old.
+"""
+
+import asyncio
+import html
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import httpx
+
+CACHE_PATH = os.path.join(os.path.dirname(__file__), "data", "link_cache.json")
+CACHE_MAX_AGE = timedelta(days=int(os.getenv("LINK_CACHE_DAYS", "7")))
+CONCURRENCY = int(os.getenv("LINK_CONCURRENCY", "16"))
+TIMEOUT = 10.0
+# Titles are in the <head>, so there's no need to download the whole page
+MAX_BYTES = 64 * 1024
+MAX_REDIRECTS = 10
+
+URL_REGEX = re.compile(r"https?://[^\s<>\"'()\[\]{}|\\^`]+", re.IGNORECASE)
+TITLE_REGEX = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+OG_TITLE_REGEX = re.compile(
+    r"<meta[^>]+property=[\"']og:title[\"'][^>]+content=[\"']([^\"']*)[\"']", re.IGNORECASE
+)
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "_hsenc", "_hsmi", "ref_src"}
+# Links that aren't news, and that mustn't be fetched in case it unsubscribes us
+SKIP_REGEX = re.compile(
+    r"unsubscribe|opt-?out|email-preferences|manage-preferences|list-manage\.com/profile",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Link:
+    url: str
+    title: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    fetched_at: str | None = None
+
+
+def extract_urls(text: str) -> list[str]:
+    """The canonical URLs of the links in the text, without duplicates, in order."""
+    urls = (canonicalise(url.rstrip(".,;:!?")) for url in URL_REGEX.findall(text))
+    return list(dict.fromkeys(url for url in urls if url and not SKIP_REGEX.search(url)))
+
+
+def canonicalise(url: str) -> str | None:
+    """Normalise a URL, dropping its fragment and any tracking parameters."""
+    try:
+        parts = urlsplit(html.unescape(url))
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return None
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ]
+    netloc = parts.hostname.lower() + (f":{parts.port}" if parts.port else "")
+    return urlunsplit(
+        (parts.scheme.lower(), netloc, parts.path or "/", urlencode(sorted(query)), "")
+    )
+
+
+def _extract_title(content: str) -> str | None:
+    match = OG_TITLE_REGEX.search(content) or TITLE_REGEX.search(content)
+    if not match:
+        return None
+    return " ".join(html.unescape(match.group(1)).split()) or None
+
+
+async def _fetch(client: httpx.AsyncClient, url: str, cached: Link | None) -> Link:
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+    now = datetime.now(timezone.utc).isoformat()
+    location = url
+    for _ in range(MAX_REDIRECTS + 1):
+        async with client.stream("GET", location, headers=headers) as response:
+            if response.is_redirect:
+                location = urljoin(str(response.url), response.headers["location"])
+                if SKIP_REGEX.search(location):
+                    print(f"Not following {url}, it redirects to {location}")
+                    return Link(url=url, fetched_at=now)
+                continue
+            if response.status_code == 304 and cached is not None:
+                return Link(**{**asdict(cached), "fetched_at": now})
+            response.raise_for_status()
+            title = None
+            if "html" in response.headers.get("content-type", ""):
+                content = b""
+                async for chunk in response.aiter_bytes():
+                    content += chunk
+                    if len(content) >= MAX_BYTES:
+                        break
+                title = _extract_title(content.decode(response.encoding or "utf-8", "replace"))
+            return Link(
+                url=canonicalise(str(response.url)) or url,
+                title=title,
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+                fetched_at=now,
+            )
+    raise httpx.TooManyRedirects(f"More than {MAX_REDIRECTS} redirects", request=response.request)
+
+
+def _is_fresh(link: Link) -> bool:
+    if link.etag or link.last_modified or not link.fetched_at:
+        return False
+    return datetime.now(timezone.utc) - datetime.fromisoformat(link.fetched_at) < CACHE_MAX_AGE
+
+
+async def _resolve(urls: list[str], cache: dict[str, Link]) -> dict[str, Link]:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+
+    # Redirects are followed by _fetch, so each one can be checked
+    async with httpx.AsyncClient(
+        timeout=TIMEOUT,
+        limits=limits,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; ai-research-agent)"},
+    ) as client:
+
+        async def resolve(url: str) -> Link:
+            cached = cache.get(url)
+            if cached is not None and _is_fresh(cached):
+                return cached
+            async with semaphore:
+                try:
+                    return await _fetch(client, url, cached)
+                except (httpx.HTTPError, httpx.InvalidURL, UnicodeError) as e:
+                    print(f"Couldn't fetch {url}: {str(e).splitlines()[0]}")
+                    # Fall back to what we had before, or just the link
+                    return cached or Link(url=url)
+
+        links = await asyncio.gather(*(resolve(url) for url in urls))
+    return dict(zip(urls, links))
+
+
+def resolve_links(urls: list[str]) -> dict[str, Link]:
+    """Fetch the final URL and title of each of the pages, keyed by the given URL."""
+    cache = {}
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH) as f:
+            cache = {url: Link(**link) for url, link in json.load(f).items()}
+    links = asyncio.run(_resolve(urls, cache))
+
+    cache.update(links)
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with open(f"{CACHE_PATH}.tmp", "w") as f:
+        json.dump({url: asdict(link) for url, link in cache.items()}, f, indent=2)
+    os.replace(f"{CACHE_PATH}.tmp", CACHE_PATH)
+    return links
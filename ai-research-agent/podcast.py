@@ -0,0 +1,125 @@
+"""Podcast generation, with the speech for each turn of the dialogue synthesised in parallel.
+
+Podcastfy writes the transcript, but rather than letting it synthesise the turns of the
+dialogue one after another, we split the transcript into turns and synthesise them
+concurrently (with at most `PODCAST_TTS_CONCURRENCY` requests at once), then stitch them
+together. Both the transcript and the audio for each turn are cached on disk, so if a run fails
+part way through, rerunning it only synthesises the turns that are missing.
+"""
+
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import yaml
+from podcastfy.client import generate_podcast
+from podcastfy.text_to_speech import TextToSpeech
+from pydub import AudioSegment
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+TRANSCRIPT_DIR = os.path.join(DATA_DIR, "transcripts")
+SEGMENT_DIR = os.path.join(DATA_DIR, "audio", "segments")
+TTS_CONCURRENCY = int(os.getenv("PODCAST_TTS_CONCURRENCY", "4"))
+CONVERSATION_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "conversation_config.yaml")
+
+
+def _hash(*parts: str | None) -> str:
+    return hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()
+
+
+def write_transcript(
+    text: str, llm_model_name: str, api_key_label: str, conversation_config: dict[str, Any]
+) -> str:
+    """Write the podcast transcript for the text, reusing it if it's already been written."""
+    path = os.path.join(
+        TRANSCRIPT_DIR,
+        f"transcript_{_hash(text, llm_model_name, repr(conversation_config))}.txt",
+    )
+    if not os.path.exists(path):
+        transcript_file = generate_podcast(
+            text=text,
+            llm_model_name=llm_model_name,
+            api_key_label=api_key_label,
+            conversation_config=conversation_config,
+            transcript_only=True,
+        )
+        os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+        shutil.copy2(transcript_file, path)
+    with open(path) as f:
+        return f.read()
+
+
+def synthesise(
+    transcript: str, tts_model: str, conversation_config: dict[str, Any], output_path: str
+):
+    """Synthesise the transcript into an MP3 at `output_path`."""
+    tts = TextToSpeech(
+        model=tts_model,
+        api_key=os.getenv(f"{tts_model.upper().replace('MULTI', '')}_API_KEY"),
+        conversation_config=conversation_config,
+    )
+    if "multi" in tts_model:
+        # Multi-speaker models synthesise the whole dialogue in one go
+        tts.convert_to_speech(transcript, output_path)
+        return
+
+    provider_config = tts._get_provider_config()
+    voices = provider_config.get("default_voices", {})
+    model = provider_config.get("model")
+    # The path of the cached audio for each turn, along with its voice and content
+    segments = []
+    for question, answer in tts.provider.split_qa(
+        transcript, tts.ending_message, tts.provider.get_supported_tags()
+    ):
+        for speaker, content in (("question", question), ("answer", answer)):
+            voice = voices.get(speaker)
+            path = os.path.join(SEGMENT_DIR, f"{_hash(tts_model, model, voice, content)}.mp3")
+            segments.append((path, voice, content))
+    # A repeated line (e.g. "Yes!") only needs synthesising once
+    missing = {path: segment for path, *segment in segments if not os.path.exists(path)}
+    print(f"Synthesising {len(missing)} of the {len(segments)} turns of the podcast")
+
+    def synthesise_turn(path: str):
+        voice, content = missing[path]
+        audio = tts.provider.generate_audio(content, voice, model)
+        # Write to a temporary file first, so a failure never leaves a partial segment
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(audio)
+        os.replace(f"{path}.tmp", path)
+
+    os.makedirs(SEGMENT_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=TTS_CONCURRENCY) as executor:
+        # Consume the results, so that any failure is raised
+        list(executor.map(synthesise_turn, missing))
+
+    podcast = AudioSegment.empty()
+    for path, _, _ in segments:
+        podcast += AudioSegment.from_file(path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    podcast.export(output_path, format="mp3")
+
+
+def create_podcast(summary: str, details: str, output_path: str):
+    """Create a podcast based on a high-level summary and further details."""
+    with open(CONVERSATION_CONFIG_PATH) as config_file:
+        conversation_config = yaml.safe_load(config_file)
+
+    if os.getenv("GEMINI_API_KEY"):
+        llm_model_name = "gemini-1.5-pro-latest"
+        api_key_label = "GEMINI_API_KEY"
+        tts_model = "gemini"
+        # If your GCP project has had multi-speaker allowlisted, you can use this instead:
+        # tts_model = "geminimulti"
+    else:
+        llm_model_name = "gpt-4o"
+        api_key_label = "OPENAI_API_KEY"
+        tts_model = "openai"
+
+    podcast_text = f"A summary of today's AI news is given by: {summary}\n\nDiving deeper, here are the full details: {details}"
+    transcript = write_transcript(
+        podcast_text, llm_model_name, api_key_label, conversation_config
+    )
+    synthesise(transcript, tts_model, conversation_config, output_path)
+
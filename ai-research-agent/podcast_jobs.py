@@ -0,0 +1,111 @@
+"""Podcast generation as a background job, so that the summary can be posted straight away.
+
+Creating the podcast takes minutes, so rather than being a step of the plan, each run of the
+agent queues a job to create it once the summary has been posted. The status of each job is
+kept in `data/podcast_jobs.json`, so if the process is restarted before a job is finished (or
+before its podcast has been posted), the job is picked up again when it restarts.
+
+A job goes from `pending` to `running` to `done` (or `failed`), and is then marked as posted
+once its podcast has been sent. Failed jobs are retried up to `MAX_ATTEMPTS` times.
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+
+from podcast import create_podcast
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+JOBS_PATH = os.path.join(DATA_DIR, "podcast_jobs.json")
+AUDIO_DIR = os.path.join(DATA_DIR, "audio")
+LATEST_PODCAST_PATH = os.path.join(AUDIO_DIR, "podcast_latest.mp3")
+MAX_ATTEMPTS = 3
+# Finished jobs to keep the status of
+MAX_FINISHED_JOBS = 20
+
+# Jobs are updated from worker threads, so reads and writes of the file are serialised
+_lock = threading.Lock()
+
+
+@dataclass
+class PodcastJob:
+    summary: str
+    details: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "pending"
+    attempts: int = 0
+    error: str | None = None
+    audio_path: str | None = None
+    posted: bool = False
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    @property
+    def finished(self) -> bool:
+        return self.posted or (self.status == "failed" and self.attempts >= MAX_ATTEMPTS)
+
+
+def _load() -> dict[str, PodcastJob]:
+    if not os.path.exists(JOBS_PATH):
+        return {}
+    with open(JOBS_PATH) as f:
+        return {job["id"]: PodcastJob(**job) for job in json.load(f)}
+
+
+def save_job(job: PodcastJob):
+    with _lock:
+        jobs = _load()
+        jobs[job.id] = job
+        # Drop the oldest finished jobs
+        finished = [job_id for job_id, job in jobs.items() if job.finished]
+        for job_id in finished[:-MAX_FINISHED_JOBS]:
+            del jobs[job_id]
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(f"{JOBS_PATH}.tmp", "w") as f:
+            json.dump([asdict(job) for job in jobs.values()], f, indent=2)
+        os.replace(f"{JOBS_PATH}.tmp", JOBS_PATH)
+
+
+def queue_job(summary: str, details: str) -> PodcastJob:
+    job = PodcastJob(summary=summary, details=details)
+    save_job(job)
+    print(f"Queued podcast job {job.id}")
+    return job
+
+
+def unfinished_jobs() -> list[PodcastJob]:
+    """Jobs whose podcast hasn't been posted yet, oldest first."""
+    with _lock:
+        return [job for job in _load().values() if not job.finished]
+
+
+def run_job(job: PodcastJob) -> PodcastJob:
+    """Create the podcast for a job, if it hasn't been created already."""
+    if job.status == "done":
+        return job
+    job.status = "running"
+    job.attempts += 1
+    save_job(job)
+    try:
+        audio_path = os.path.join(AUDIO_DIR, f"podcast_{job.id}.mp3")
+        create_podcast(job.summary, job.details, audio_path)
+        # Also copy it to a standard location for the latest podcast
+        shutil.copy2(audio_path, LATEST_PODCAST_PATH)
+    except Exception as e:
+        print(f"Podcast job {job.id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    else:
+        job.status = "done"
+        job.error = None
+        job.audio_path = audio_path
+    save_job(job)
+    return job
+
+
+def mark_posted(job: PodcastJob):
+    job.posted = True
+    save_job(job)
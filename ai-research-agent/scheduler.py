@@ -0,0 +1,129 @@
+"""A small cron-style scheduler for running the agent from a long-lived process.
+
+Schedules use the standard five cron fields (minute, hour, day of month, month, day of week),
+each of which can be `*`, a number, a range (`1-5`), a list (`1,3,5`) or a step (`*/15`,
+`0-30/10`). Times are in UTC, matching the schedule in `.github/workflows/run.yml`.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+
+# (min, max) of each field: minute, hour, day of month, month, day of week (0 = Sunday)
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+
+class CronSchedule:
+    """A parsed cron expression."""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        # As in cron, if both day fields are restricted, a day matching either is run
+        self.any_day = fields[2] == "*" or fields[4] == "*"
+
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expression!r})"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day = dt.day in self.days
+        # datetime counts weekdays from Monday = 0, cron from Sunday = 0
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        return day and weekday if self.any_day else day or weekday
+
+    def next_after(self, dt: datetime) -> datetime:
+        """The first time strictly after `dt` that matches the schedule."""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Every schedule matches at least once within a few years (e.g. the 29th of February)
+        limit = dt + timedelta(days=5 * 366)
+        while dt < limit:
+            if dt.month not in self.months or not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+def _parse_field(field: str, low: int, high: int) -> set[int]:
+    values = set()
+    for part in field.split(","):
+        range_part, _, step = part.partition("/")
+        if range_part == "*":
+            start, end = low, high
+        elif "-" in range_part:
+            start, end = (int(value) for value in range_part.split("-"))
+        else:
+            start = end = int(range_part)
+            if step:
+                end = high
+        # Allow 7 for Sunday in the day of week field
+        if high == 6 and end == 7:
+            values.add(0)
+            if start == 7:
+                continue
+            end = 6
+        if not low <= start <= end <= high:
+            raise ValueError(f"Invalid cron field {field!r}, values must be in {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class Scheduler:
+    """Runs async jobs on cron schedules, never running two instances of a job at once.
+
+    If a job is still running when it is next due, that run is skipped rather than queued, so a
+    slow run doesn't cause a pile-up of runs afterwards.
+    """
+
+    def __init__(self):
+        self._jobs: list[tuple[str, list[CronSchedule], Callable[[], Awaitable[None]]]] = []
+        self._running: set[str] = set()
+        # References to the running tasks, so they aren't garbage collected part way through
+        self._tasks: set[asyncio.Task] = set()
+
+    def add_job(self, name: str, schedules: list[str], job: Callable[[], Awaitable[None]]):
+        self._jobs.append((name, [CronSchedule(schedule) for schedule in schedules], job))
+
+    async def run_forever(self):
+        await asyncio.gather(
+            *(self._run_schedule(name, schedule, job)
+              for name, schedules, job in self._jobs
+              for schedule in schedules)
+        )
+
+    async def _run_schedule(
+        self, name: str, schedule: CronSchedule, job: Callable[[], Awaitable[None]]
+    ):
+        while True:
+            now = datetime.now(timezone.utc)
+            next_run = schedule.next_after(now)
+            print(f"Next run of {name} ({schedule.expression}) at {next_run:%Y-%m-%d %H:%M} UTC")
+            # Sleep in steps, so that we don't drift (e.g. across a machine suspend)
+            while (remaining := (next_run - datetime.now(timezone.utc)).total_seconds()) > 0:
+                await asyncio.sleep(min(remaining, 60))
+            if name in self._running:
+                print(f"Skipping run of {name}, the previous run is still going")
+                continue
+            # Mark the job as running before yielding to the loop, so a schedule due at the same
+            # time sees it
+            self._running.add(name)
+            task = asyncio.create_task(self._run_job(name, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, name: str, job: Callable[[], Awaitable[None]]):
+        try:
+            await job()
+        except Exception as e:
+            print(f"Run of {name} failed: {e}")
+        finally:
+            self._running.discard(name)
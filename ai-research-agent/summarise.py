@@ -0,0 +1,253 @@
+"""Map-reduce summarisation of the day's emails.
+
+Summarising all of the emails in a single LLM call overflows the context window on busy days,
+and is slow, so instead:
+- Map: the emails are split into batches that fit in a token budget, and notes on the news in
+  each email are taken from each batch in parallel (with at most `SUMMARISE_CONCURRENCY` calls
+  at once). The notes for each email are cached by its message ID, so emails that have already
+  been seen (e.g. when a failed run is retried) aren't summarised again. Any emails the model
+  leaves out are given a second try, and if there are still no notes on them, they aren't
+  recorded as summarised.
+- Reduce: the notes are combined into the final summary. If there are too many notes to fit in
+  one call, groups of them are first combined into shorter notes.
+
+The titles of the web pages linked from the emails are looked up beforehand (see `links.py`) and
+given along with the emails, so the summary can link to them by their actual titles.
+
+If some emails have already been summarised today (see `email_store.py`), only the new emails
+are summarised, and their notes are folded into the existing summary.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from email_store import load_day, load_notes, save_day, save_notes
+from langchain_openai import ChatOpenAI
+from links import Link, extract_urls, resolve_links
+from portia import Tool, ToolRunContext
+from pydantic import BaseModel, Field
+
+MODEL = "gpt-4o"
+# Rough token counts are fine for sizing batches
+CHARS_PER_TOKEN = 4
+# Tokens of email per map call, and of notes per reduce call
+MAP_TOKEN_BUDGET = int(os.getenv("SUMMARISE_MAP_TOKENS", "24000"))
+REDUCE_TOKEN_BUDGET = int(os.getenv("SUMMARISE_REDUCE_TOKENS", "48000"))
+CONCURRENCY = int(os.getenv("SUMMARISE_CONCURRENCY", "4"))
+# Newsletters can have a lot of links, so only the first of each are looked up
+MAX_LINKS_PER_EMAIL = 40
+
+MAP_PROMPT = (
+    "Below are some emails from AI newsletters. For each email, make notes on the AI news it "
+    "contains: a sentence or two on each story, along with the title and link of any web pages "
+    "about it. Use the titles and links given under 'Linked web pages' where possible, as "
+    "they're the actual titles of the pages. Ignore adverts, sponsorship and anything that isn't news about AI. If an email "
+    "has no AI news, leave its notes empty.\n\n{emails}"
+)
+COMBINE_PROMPT = (
+    "Below are notes on today's AI news, taken from several newsletters. Combine them into a "
+    "single, shorter set of notes, merging stories that appear more than once and keeping the "
+    "title and link of the web pages about each.\n\n{notes}"
+)
+REDUCE_PROMPT = (
+    "Below are notes on today's AI news, taken from several newsletters. Write a single, "
+    "coherent summary of them (i.e. don't summarise each newsletter separately). "
+    "The summary should be focussed on 3 key themes, with each having a text summary and then a "
+    "bullet-pointed list (up to 3 bullets) associated with each theme with web pages "
+    "(title + link) for people to investigate further. "
+    "The heading should be 'Daily AI News Update' and the summary should be in a format "
+    "suitable for sending on slack / discord (i.e. no markdown formatting).\n\n{notes}"
+)
+FOLD_PROMPT = (
+    "Below is today's summary of AI news so far, followed by notes on some more news that has "
+    "come in since. Update the summary to include the new news, keeping its format: 3 key "
+    "themes (which may change if the new news is more important), each with a text summary and "
+    "up to 3 bullets of web pages (title + link) for people to investigate further, under the "
+    "heading 'Daily AI News Update', with no markdown formatting.\n\n"
+    "Summary so far:\n{summary}\n\nNew notes:\n{notes}"
+)
+
+
+class EmailNotes(BaseModel):
+    message_id: str = Field(..., description="The message ID of the email.")
+    notes: str = Field(..., description="Notes on the AI news in the email.")
+
+
+class BatchNotes(BaseModel):
+    emails: list[EmailNotes]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_id(email: dict[str, Any]) -> str:
+    for key in ("id", "message_id", "messageId"):
+        if email.get(key):
+            return str(email[key])
+    # Fall back to the content, so that the email can still be cached
+    return hashlib.sha1(json.dumps(email, sort_keys=True).encode()).hexdigest()
+
+
+def format_email(email_id: str, email: dict[str, Any], links: dict[str, Link]) -> str:
+    fields = {key: value for key, value in email.items() if key not in ("id", "message_id")}
+    lines = [f"Message ID: {email_id}"] + [f"{key}: {value}" for key, value in fields.items()]
+    linked_pages = [
+        f"- {link.title}: {link.url}"
+        for url in email_urls(email)
+        if (link := links.get(url)) and link.title
+    ]
+    if linked_pages:
+        lines += ["Linked web pages:", *linked_pages]
+    return "\n".join(lines)
+
+
+def email_urls(email: dict[str, Any]) -> list[str]:
+    return extract_urls(json.dumps(email))[:MAX_LINKS_PER_EMAIL]
+
+
+def batch_by_tokens(texts: list[str], budget: int) -> list[list[str]]:
+    """Group texts into batches of at most `budget` tokens, truncating any that are too long."""
+    batches: list[list[str]] = []
+    batch_tokens = 0
+    for text in texts:
+        if estimate_tokens(text) > budget:
+            text = text[: budget * CHARS_PER_TOKEN]
+        tokens = estimate_tokens(text)
+        if not batches or batch_tokens + tokens > budget:
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(text)
+        batch_tokens += tokens
+    return batches
+
+
+def summarise_emails(emails: list[dict[str, Any]], llm: ChatOpenAI | None = None) -> str:
+    """Summarise the emails into the 3-theme summary, along with those already summarised today."""
+    llm = llm or ChatOpenAI(model=MODEL)
+    notes = load_notes()
+    day = load_day()
+    emails_by_id = {message_id(email): email for email in emails}
+    # Skip any emails that are already in today's summary
+    new_ids = [email_id for email_id in emails_by_id if email_id not in day["message_ids"]]
+    uncached_ids = [email_id for email_id in new_ids if email_id not in notes]
+    print(
+        f"Summarising {len(new_ids)} new emails ({len(new_ids) - len(uncached_ids)} cached, "
+        f"{len(day['message_ids'])} already summarised today)"
+    )
+
+    urls = {url for email_id in uncached_ids for url in email_urls(emails_by_id[email_id])}
+    links = resolve_links(sorted(urls)) if urls else {}
+    # The model can leave emails out, so any that it missed get a second chance
+    for _ in range(2):
+        missing = [email_id for email_id in uncached_ids if email_id not in notes]
+        if not missing:
+            break
+        notes.update(_take_notes(missing, emails_by_id, links, llm))
+        save_notes(notes)
+
+    # Emails without notes aren't recorded as summarised, so they're retried if seen again
+    summarised_ids = [email_id for email_id in new_ids if email_id in notes]
+    if len(summarised_ids) < len(new_ids):
+        print(f"Couldn't take notes on {len(new_ids) - len(summarised_ids)} emails")
+    new_notes = [notes[email_id] for email_id in summarised_ids if notes[email_id]]
+    if not new_notes:
+        save_day(day["message_ids"] + summarised_ids, day["summary"])
+        return day["summary"] or "There's no AI news today."
+    notes_text = _combine(new_notes, llm)
+    if day["summary"]:
+        summary = llm.invoke(FOLD_PROMPT.format(summary=day["summary"], notes=notes_text)).content
+    else:
+        summary = llm.invoke(REDUCE_PROMPT.format(notes=notes_text)).content
+    save_day(day["message_ids"] + summarised_ids, summary)
+    return summary
+
+
+def _take_notes(
+    email_ids: list[str],
+    emails_by_id: dict[str, dict[str, Any]],
+    links: dict[str, Link],
+    llm: ChatOpenAI,
+) -> dict[str, str]:
+    """Take notes on the emails in batches (the map step), returning the notes by message ID."""
+    batches = batch_by_tokens(
+        [format_email(email_id, emails_by_id[email_id], links) for email_id in email_ids],
+        MAP_TOKEN_BUDGET,
+    )
+    # The IDs of the emails in each batch (batching keeps them in order)
+    remaining = iter(email_ids)
+    batch_ids = [[next(remaining) for _ in batch] for batch in batches]
+    map_llm = llm.with_structured_output(BatchNotes)
+    notes = {}
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = executor.map(
+            lambda batch: map_llm.invoke(MAP_PROMPT.format(emails="\n\n---\n\n".join(batch))),
+            batches,
+        )
+        for ids, result in zip(batch_ids, results):
+            batch_notes = {
+                email.message_id.strip(): email.notes
+                for email in result.emails
+                if email.message_id.strip() in ids
+            }
+            if len(batch_notes) < len(ids) and len(result.emails) == len(ids):
+                # Some IDs weren't given back as they were, but there are notes for every email,
+                # so match them up in order
+                for email_id, email in zip(ids, result.emails):
+                    batch_notes.setdefault(email_id, email.notes)
+            notes.update(batch_notes)
+    return notes
+
+
+def _combine(notes: list[str], llm: ChatOpenAI) -> str:
+    """Combine the notes into a single set that fits in one call."""
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        # Combine groups of notes until they all fit in a single call (stopping if the notes are
+        # each so long that they can't be grouped)
+        while 1 < len(batches := batch_by_tokens(notes, REDUCE_TOKEN_BUDGET)) < len(notes):
+            notes = list(
+                executor.map(
+                    lambda batch: llm.invoke(
+                        COMBINE_PROMPT.format(notes="\n\n".join(batch))
+                    ).content,
+                    batches,
+                )
+            )
+    return "\n\n".join(notes)[: REDUCE_TOKEN_BUDGET * CHARS_PER_TOKEN]
+
+
+class SummariseEmailsToolSchema(BaseModel):
+    """Input for SummariseEmailsTool."""
+
+    emails: list[dict[str, Any]] | str = Field(
+        ...,
+        description="The emails to summarise, as returned by the Gmail search tool.",
+    )
+
+
+class SummariseEmailsTool(Tool[str]):
+    """Summarise a set of emails about AI news into the daily summary."""
+
+    id: str = "summarise_emails_tool"
+    name: str = "Summarise Emails Tool"
+    description: str = (
+        "Used to summarise emails about AI news into the 'Daily AI News Update', focussed on 3 "
+        "key themes with links for further reading, in a format suitable for slack / discord. "
+        "Handles any number of emails."
+    )
+    args_schema: type[BaseModel] = SummariseEmailsToolSchema
+    output_schema: tuple[str, str] = ("str", "The summary of the emails.")
+
+    def run(self, _: ToolRunContext, emails: list[dict[str, Any]] | str) -> str:
+        """Run the Summarise Emails Tool."""
+        if isinstance(emails, str):
+            try:
+                emails = json.loads(emails)
+            except json.JSONDecodeError:
+                emails = [{"body": emails}]
+        if isinstance(emails, dict):
+            emails = [emails]
+        return summarise_emails(emails)
@@ -0,0 +1,235 @@
+"""Load test the bot's answer path offline, with stand-ins for the LLM, embeddings and Portia.
+
+Simulated users send questions concurrently through the same path as the `/ask` command: the
+`AskQueue`, then `bot.ask.stream_answer` with its routing, answer cache, retrieval, packing and
+generation. The external services are replaced with deterministic stand-ins, so the test runs
+offline (e.g. in CI):
+- The LLM is a `FakeListChatModel`, streaming a canned answer over `--llm-ms`.
+- Retrieval uses a `LocalBackend` over a synthetic corpus embedded with
+  `DeterministicFakeEmbedding`, with an optional delay to simulate a remote vector store.
+- Portia's planning and plan runs are stubbed out, taking `--planning-ms` and `--execution-ms`.
+
+Reports throughput, end-to-end latency percentiles and the time spent in each stage. Pass
+`--max-p95-ms` to exit with an error if the p95 latency is above a limit.
+
+Run with `poetry run python -m benchmarks.load_test --concurrency 32 --requests 500`.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+# Nothing calls OpenAI, but the clients created when bot.ask is imported need a key
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+
+from portia import PlanRunState  # noqa: E402
+
+from bot import ask, retrieval  # noqa: E402
+from bot.cache import AnswerCache  # noqa: E402
+from bot.chunking import chunk_uuid  # noqa: E402
+from bot.local_index import LocalBackend  # noqa: E402
+from bot.timing import record_stages  # noqa: E402
+from bot.workers import AskQueue, QueueFullError, RateLimiter  # noqa: E402
+
+ANSWER = (
+    "You can configure this through the Portia config, which is passed to the Portia "
+    "constructor. See the storage and execution sections of the SDK docs for the available "
+    "options and their defaults, along with examples of each."
+)
+VOCABULARY = [f"term{i}" for i in range(2000)]
+STAGES = ["answer_cache", "retrieval", "generation", "planning", "execution"]
+
+
+class DelayedLocalBackend(LocalBackend):
+    """A local backend that takes at least `delay` seconds per query, like a remote one."""
+
+    def __init__(self, *args, delay: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def query(self, question: str, limit: int = 5, exact: bool = False):
+        time.sleep(self.delay)
+        return super().query(question, limit=limit, exact=exact)
+
+
+class StubPortia:
+    """Stands in for Portia, taking a fixed time to plan and run each question."""
+
+    def __init__(self, planning_delay: float, execution_delay: float):
+        self.planning_delay = planning_delay
+        self.execution_delay = execution_delay
+
+    def plan(self, query: str):
+        time.sleep(self.planning_delay)
+        return SimpleNamespace(query=query)
+
+    def run_plan(self, plan):
+        time.sleep(self.execution_delay)
+        return SimpleNamespace(
+            state=PlanRunState.COMPLETE,
+            outputs=SimpleNamespace(final_output=SimpleNamespace(value=ANSWER)),
+        )
+
+
+def build_corpus(backend: LocalBackend, pages: int, chunks_per_page: int, rng: random.Random):
+    """Fill the backend with pages of consecutive chunks of random terms."""
+    objects = []
+    for page in range(pages):
+        source = f"https://docs.example.com/page-{page}"
+        start = 0
+        for i in range(chunks_per_page):
+            text = " ".join(rng.choices(VOCABULARY, k=150))
+            metadata = {"source": source, "start_index": start, "chunk_index": i}
+            objects.append((chunk_uuid(source, i), {"text": text, "metadata": metadata}))
+            start += len(text) + 1
+    backend.insert_chunks(objects)
+
+
+def make_questions(count: int, planner_fraction: float, rng: random.Random) -> list[str]:
+    questions = []
+    for _ in range(count):
+        a, b = rng.sample(VOCABULARY, 2)
+        if rng.random() < planner_fraction:
+            # Routed to the planner by mentioning GitHub
+            questions.append(f"Are there any open GitHub issues about {a} and {b}?")
+        else:
+            questions.append(f"How do I use {a} with {b}?")
+    return questions
+
+
+async def run_load(
+    queue: AskQueue, questions: list[str], requests: int, concurrency: int
+) -> tuple[list[float], int, int, float]:
+    """Send `requests` questions from `concurrency` users, each waiting for its last answer.
+
+    Returns the latencies (in seconds), the numbers rejected and failed, and the elapsed time.
+    """
+    latencies = []
+    rejected = failed = 0
+    next_request = iter(range(requests))
+
+    async def user(user_id: int):
+        nonlocal rejected, failed
+        for i in next_request:
+            start = time.perf_counter()
+            try:
+                job = queue.submit(questions[i % len(questions)], f"user-{user_id}", "load-test")
+                await job.future
+            except QueueFullError:
+                rejected += 1
+                continue
+            except Exception as e:
+                print(f"Request failed: {e}")
+                failed += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(concurrency)))
+    return latencies, rejected, failed, time.perf_counter() - start
+
+
+def percentiles(seconds: list[float]) -> str:
+    p50, p95, p99 = np.percentile(np.array(seconds) * 1000, [50, 95, 99])
+    return f"p50 {p50:8.1f}ms  p95 {p95:8.1f}ms  p99 {p99:8.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="Simulated users")
+    parser.add_argument("--workers", type=int, default=4, help="AskQueue worker threads")
+    parser.add_argument("--max-pending", type=int, default=32)
+    parser.add_argument(
+        "--unique-questions",
+        type=int,
+        default=None,
+        help="Cycle through this many distinct questions (defaults to one per request)",
+    )
+    parser.add_argument("--planner-fraction", type=float, default=0.2)
+    parser.add_argument(
+        "--answer-cache", action="store_true", help="Enable the answer cache"
+    )
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--chunks-per-page", type=int, default=5)
+    parser.add_argument("--retrieval-ms", type=float, default=20)
+    parser.add_argument("--llm-ms", type=float, default=300)
+    parser.add_argument("--planning-ms", type=float, default=500)
+    parser.add_argument("--execution-ms", type=float, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--max-p95-ms", type=float, default=None, help="Fail if p95 latency is above this"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    embeddings = DeterministicFakeEmbedding(size=384)
+    # Each streamed chunk is one character of the answer
+    ask.llm = FakeListChatModel(responses=[ANSWER], sleep=args.llm_ms / 1000 / len(ANSWER))
+    ask.portia = StubPortia(args.planning_ms / 1000, args.execution_ms / 1000)
+    ask.answer_cache = AnswerCache(embeddings, max_entries=1000 if args.answer_cache else 0)
+    ask.ASK_MODE = "auto"
+
+    stage_timings: list[dict[str, float]] = []
+
+    def answer_fn(question: str):
+        with record_stages() as timings:
+            yield from ask.stream_answer(question)
+        stage_timings.append(timings)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        backend = DelayedLocalBackend(
+            path=index_dir,
+            embeddings=embeddings,
+            model_name="deterministic-fake",
+            delay=args.retrieval_ms / 1000,
+        )
+        build_corpus(backend, args.pages, args.chunks_per_page, rng)
+        retrieval._backend = backend
+
+        queue = AskQueue(
+            answer_fn,
+            workers=args.workers,
+            max_pending=args.max_pending,
+            user_limiter=RateLimiter(limit=sys.maxsize, window=60),
+            channel_limiter=RateLimiter(limit=sys.maxsize, window=60),
+        )
+        questions = make_questions(
+            args.unique_questions or args.requests, args.planner_fraction, rng
+        )
+        print(
+            f"Sending {args.requests} requests from {args.concurrency} users to "
+            f"{args.workers} workers..."
+        )
+        latencies, rejected, failed, elapsed = asyncio.run(
+            run_load(queue, questions, args.requests, args.concurrency)
+        )
+
+    print(
+        f"\n{len(latencies)} answered, {rejected} rejected (queue full), {failed} failed "
+        f"in {elapsed:.1f}s: {len(latencies) / elapsed:.1f} requests/sec"
+    )
+    if not latencies:
+        sys.exit("No requests were answered")
+    print(f"{'end to end':<14}{'':>7}  {percentiles(latencies)}")
+    for name in STAGES:
+        samples = [timings[name] for timings in stage_timings if name in timings]
+        if samples:
+            print(f"{name:<14}{len(samples):>7}  {percentiles(samples)}")
+
+    p95 = np.percentile(latencies, 95) * 1000
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        sys.exit(f"p95 latency {p95:.1f}ms is above the limit of {args.max_p95_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare the local and Weaviate retrieval backends on the same chunk set.
+
+Exports every chunk from the Weaviate `SDK_Docs` collection, builds a local index from them and
+then runs the same queries against both backends. Reports query latency for each backend, the
+recall@k of the local backend's IVF search against an exact search of the same index, and its
+recall@k against the Weaviate results (which also captures the difference in embedding model).
+
+Run with `poetry run python -m benchmarks.retrieval_backends`.
+"""
+
+import argparse
+import random
+import re
+import tempfile
+import time
+
+import numpy as np
+
+from bot.local_index import LocalBackend
+from bot.weaviate import WeaviateBackend, close_weaviate, get_docs_collection
+
+
+def export_chunks() -> list[tuple[str, dict]]:
+    return [
+        (str(obj.uuid), {"text": obj.properties["text"], "metadata": obj.properties.get("metadata") or {}})
+        for obj in get_docs_collection().iterator(return_properties=["text", "metadata"])
+    ]
+
+
+def sample_queries(chunks: list[tuple[str, dict]], n: int) -> list[str]:
+    """Use the first sentence of randomly chosen chunks as queries."""
+    rng = random.Random(42)
+    queries = []
+    for _, properties in rng.sample(chunks, min(n, len(chunks))):
+        sentence = re.split(r"(?<=[.?!])\s", properties["text"].strip(), maxsplit=1)[0]
+        queries.append(sentence[:200])
+    return queries
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def recall(results: list[list[str]], expected: list[list[str]]) -> float:
+    return float(
+        np.mean([len(set(r) & set(e)) / max(len(e), 1) for r, e in zip(results, expected)])
+    )
+
+
+def report_latency(name: str, latencies: list[float]):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{name:<22} p50 {p50:7.2f}ms  p95 {p95:7.2f}ms  p99 {p99:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    chunks = export_chunks()
+    queries = sample_queries(chunks, args.queries)
+    print(f"Exported {len(chunks)} chunks, running {len(queries)} queries with k={args.k}")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        local = LocalBackend(path=index_dir, nprobe=args.nprobe)
+        _, build_ms = timed(local.insert_chunks, chunks)
+        print(f"Built local index in {build_ms / 1000:.1f}s")
+        weaviate = WeaviateBackend()
+
+        results = {"weaviate": [], "local (ivf)": [], "local (exact)": []}
+        latencies = {name: [] for name in results}
+        for query in queries:
+            for name, search in [
+                ("weaviate", lambda q: weaviate.query(q, limit=args.k)),
+                ("local (ivf)", lambda q: local.query(q, limit=args.k)),
+                ("local (exact)", lambda q: local.query(q, limit=args.k, exact=True)),
+            ]:
+                hits, ms = timed(search, query)
+                results[name].append([hit.id for hit in hits])
+                latencies[name].append(ms)
+
+    for name, values in latencies.items():
+        report_latency(name, values)
+    print(
+        f"recall@{args.k} local ivf vs exact:    "
+        f"{recall(results['local (ivf)'], results['local (exact)']):.3f}"
+    )
+    print(
+        f"recall@{args.k} local ivf vs weaviate: "
+        f"{recall(results['local (ivf)'], results['weaviate']):.3f}"
+    )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        close_weaviate()
@@ -0,0 +1,245 @@
+"""Compare vector index settings for the `SDK_Docs` collection on memory, latency and recall.
+
+Exports every chunk and its embedding from the `SDK_Docs` collection, then for each quantizer
+and `maxConnections` setting builds a scratch collection with the same schema (without a
+vectoriser, so no embedding API calls are made) and sweeps `ef` over it. Some chunks are held
+out of the scratch collections and their embeddings are used as queries, with the exact
+nearest neighbours found by brute force in NumPy as the ground truth.
+
+For each setting, reports:
+- The estimated in-memory size of the vector index (compressed vectors plus HNSW graph).
+- The growth in Weaviate's Go heap while the collection is loaded, if Prometheus monitoring is
+  enabled (it is in compose.yaml). This is noisier, as it depends on garbage collection.
+- Query latency p50/p99 and recall@k against the exact results.
+
+Run against the local compose.yaml Weaviate with
+`poetry run python -m benchmarks.vector_compression --quantizers none,pq,bq,sq --ef 64,128,256`.
+"""
+
+import argparse
+import itertools
+import re
+import time
+
+import httpx
+import numpy as np
+from weaviate.classes.config import Configure, Reconfigure
+
+from bot.weaviate import (
+    QUANTIZERS,
+    _create_docs_collection,
+    close_weaviate,
+    get_docs_collection,
+    get_weaviate_client,
+    vector_index_config,
+)
+
+BENCHMARK_COLLECTION_PREFIX = "SDK_Docs_Benchmark_"
+WEAVIATE_METRICS_URL = "http://localhost:2112/metrics"
+# Weaviate's defaults
+DEFAULT_MAX_CONNECTIONS = 32
+# Roughly the memory used by each link in the HNSW graph
+BYTES_PER_CONNECTION = 10
+
+
+def export_chunks() -> tuple[list[str], list[dict], np.ndarray]:
+    ids, properties, vectors = [], [], []
+    for obj in get_docs_collection().iterator(
+        include_vector=True, return_properties=["text", "metadata"]
+    ):
+        vector = obj.vector.get("default") if isinstance(obj.vector, dict) else obj.vector
+        ids.append(str(obj.uuid))
+        properties.append(obj.properties)
+        vectors.append(vector)
+    return ids, properties, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_neighbours(index: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """The rows of `index` with the highest cosine similarity to each query."""
+    index = index / np.linalg.norm(index, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ index.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(
+        top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1
+    )
+
+
+def heap_in_use() -> float | None:
+    """Weaviate's Go heap in use, in bytes, or None if its metrics aren't enabled."""
+    try:
+        response = httpx.get(WEAVIATE_METRICS_URL, timeout=5)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    match = re.search(r"^go_memstats_heap_inuse_bytes ([0-9.e+]+)$", response.text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def estimate_index_bytes(
+    count: int, dims: int, quantizer: str, max_connections: int, segments: int | None
+) -> int:
+    """Estimate the memory used by the vector index, following Weaviate's sizing guide."""
+    bytes_per_vector = {
+        "none": 4 * dims,
+        "pq": segments or dims // 4,
+        "bq": dims // 8,
+        "sq": dims,
+    }[quantizer]
+    # The bottom layer of the graph has up to twice maxConnections links per node
+    return count * (bytes_per_vector + 2 * max_connections * BYTES_PER_CONNECTION)
+
+
+def wait_for_indexing(name: str, compressed: bool, timeout: float = 600):
+    """Wait until every shard of the collection is indexed (and compressed, if requested)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        nodes = get_weaviate_client().cluster.nodes(collection=name, output="verbose")
+        shards = [shard for node in nodes for shard in node.shards or []]
+        if shards and all(
+            shard.vector_indexing_status == "READY"
+            and shard.vector_queue_length == 0
+            and (shard.compressed or not compressed)
+            for shard in shards
+        ):
+            return
+        time.sleep(1)
+    raise TimeoutError(f"{name} was not indexed after {timeout:.0f}s")
+
+
+def build_collection(
+    name: str,
+    quantizer: str,
+    max_connections: int | None,
+    ids: list[str],
+    properties: list[dict],
+    vectors: np.ndarray,
+):
+    client = get_weaviate_client()
+    if client.collections.exists(name):
+        client.collections.delete(name)
+    _create_docs_collection(
+        client,
+        name=name,
+        vectorizer_config=Configure.Vectorizer.none(),
+        # Train the quantizer on every vector, rather than waiting for the default 100,000
+        index_config=vector_index_config(
+            quantizer, max_connections=max_connections, training_limit=len(ids)
+        ),
+    )
+    collection = client.collections.get(name)
+    with collection.batch.dynamic() as batch:
+        for uuid, props, vector in zip(ids, properties, vectors):
+            batch.add_object(properties=props, uuid=uuid, vector=vector.tolist())
+    if collection.batch.failed_objects:
+        raise RuntimeError(
+            f"Failed to insert {len(collection.batch.failed_objects)} objects: "
+            f"{collection.batch.failed_objects[0].message}"
+        )
+    wait_for_indexing(name, compressed=quantizer != "none")
+    return collection
+
+
+def run_queries(collection, queries: np.ndarray, k: int) -> tuple[list[list[str]], list[float]]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response = collection.query.near_vector(
+            near_vector=query.tolist(), limit=k, return_properties=[]
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([str(obj.uuid) for obj in response.objects])
+    return results, latencies
+
+
+def recall(results: list[list[str]], expected: list[list[str]]) -> float:
+    return float(
+        np.mean([len(set(r) & set(e)) / max(len(e), 1) for r, e in zip(results, expected)])
+    )
+
+
+def parse_list(value: str, type_=str) -> list:
+    return [type_(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--quantizers", type=parse_list, default=list(QUANTIZERS))
+    parser.add_argument(
+        "--max-connections",
+        type=lambda v: parse_list(v, int),
+        default=[DEFAULT_MAX_CONNECTIONS],
+    )
+    parser.add_argument("--ef", type=lambda v: parse_list(v, int), default=[64, 128, 256])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument(
+        "--keep", action="store_true", help="Don't delete the scratch collections afterwards"
+    )
+    args = parser.parse_args()
+
+    ids, properties, vectors = export_chunks()
+    if len(ids) <= args.queries:
+        parser.error(f"Only {len(ids)} chunks in SDK_Docs, need more than --queries")
+    # Hold the query chunks out of the index, so that a chunk isn't its own nearest neighbour
+    rng = np.random.default_rng(42)
+    order = rng.permutation(len(ids))
+    query_rows, index_rows = order[: args.queries], order[args.queries :]
+    index_ids = [ids[row] for row in index_rows]
+    index_properties = [properties[row] for row in index_rows]
+    index_vectors, queries = vectors[index_rows], vectors[query_rows]
+    expected = [
+        [index_ids[row] for row in rows]
+        for rows in exact_neighbours(index_vectors, queries, args.k)
+    ]
+    print(
+        f"Exported {len(ids)} chunks ({vectors.shape[1]} dims), indexing {len(index_ids)} "
+        f"and running {len(queries)} queries with k={args.k}"
+    )
+
+    client = get_weaviate_client()
+    rows = []
+    for i, (quantizer, max_connections) in enumerate(
+        itertools.product(args.quantizers, args.max_connections)
+    ):
+        name = f"{BENCHMARK_COLLECTION_PREFIX}{i}"
+        heap_before = heap_in_use()
+        collection = build_collection(
+            name, quantizer, max_connections, index_ids, index_properties, index_vectors
+        )
+        heap_after = heap_in_use()
+        segments = getattr(collection.config.get().vector_index_config.quantizer, "segments", None)
+        estimate = estimate_index_bytes(
+            len(index_ids), vectors.shape[1], quantizer, max_connections, segments
+        )
+        heap = None if heap_before is None or heap_after is None else heap_after - heap_before
+        for ef in args.ef:
+            collection.config.update(vector_index_config=Reconfigure.VectorIndex.hnsw(ef=ef))
+            # Warm up, so that the first timed queries don't load the index from disk
+            run_queries(collection, queries[:10], args.k)
+            results, latencies = run_queries(collection, queries, args.k)
+            p50, p99 = np.percentile(latencies, [50, 99])
+            rows.append(
+                (quantizer, max_connections, ef, estimate, heap, p50, p99, recall(results, expected))
+            )
+            print(f"Finished {quantizer} maxConnections={max_connections} ef={ef}")
+        if not args.keep:
+            client.collections.delete(name)
+
+    print(
+        f"\n{'quantizer':<10}{'maxConn':>8}{'ef':>6}{'est. index':>12}{'heap growth':>13}"
+        f"{'p50':>10}{'p99':>10}{f'recall@{args.k}':>11}"
+    )
+    for quantizer, max_connections, ef, estimate, heap, p50, p99, value in rows:
+        heap_mb = "n/a" if heap is None else f"{heap / 2**20:.1f}MB"
+        print(
+            f"{quantizer:<10}{max_connections:>8}{ef:>6}{estimate / 2**20:>10.1f}MB{heap_mb:>13}"
+            f"{p50:>8.2f}ms{p99:>8.2f}ms{value:>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        close_weaviate()
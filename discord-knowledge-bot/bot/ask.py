@@ -1,5 +1,10 @@
 """Simple Ask RAG Interface."""
 
+import os
+import re
+from collections.abc import Iterator
+
+from langchain_openai import ChatOpenAI
 from portia import (
     Config,
     DefaultToolRegistry,
@@ -9,28 +14,109 @@ from portia import (
     Portia,
 )
 
-from bot.weaviate import RAGQueryDBTool, close_weaviate
+from bot.cache import AnswerCache
+from bot.packing import format_context
+from bot.retrieval import (
+    RETRIEVAL_PROMPT,
+    RAGQueryDBTool,
+    close_retrieval_backend,
+    get_retrieval_backend,
+)
+from bot.timing import stage, timed_iter
 
 config = Config.from_default(
     default_log_level=LogLevel.DEBUG,
     default_model="openai/gpt-4o",
 )
+rag_tool = RAGQueryDBTool(
+    description="Used to retrieve information from the Portia SDK docs.",
+)
 registry = DefaultToolRegistry(config) + InMemoryToolRegistry.from_local_tools(
-    [
-        RAGQueryDBTool(
-            description="Used to retrieve information from the Portia SDK docs.",
-        ),
-    ],
+    [rag_tool],
 )
 portia = Portia(config, tools=registry)
+llm = ChatOpenAI(model="gpt-4o")
+# Questions are embedded with the retrieval backend's model, so a local backend needs no API
+answer_cache = AnswerCache(
+    get_retrieval_backend().query_embeddings(),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 60 * 60))),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+)
+
+# "rag" always answers straight from the docs, "planner" always uses a Portia run and "auto"
+# only uses a Portia run for questions that look like they need tools other than the docs.
+ASK_MODE = os.getenv("ASK_MODE", "auto")
+PLANNER_PATTERN = re.compile(
+    r"\b(github|issues?|pull requests?|prs?|commits?|releases?|changelog|repo(sitory)?)\b",
+    re.IGNORECASE,
+)
+
+
+def needs_planner(question: str) -> bool:
+    """Whether a question needs more than the docs to answer it."""
+    if ASK_MODE == "planner":
+        return True
+    if ASK_MODE == "rag":
+        return False
+    return PLANNER_PATTERN.search(question) is not None
 
 
 def get_answer(question: str) -> str | None:
+    answer = "".join(stream_answer(question))
+    return answer or None
+
+
+def stream_answer(question: str) -> Iterator[str]:
+    """Answer a question, yielding the answer in pieces as it is generated.
+
+    Nothing is yielded if no answer could be found.
+    """
+    with stage("answer_cache"):
+        cached = answer_cache.get(question)
+    if cached is not None:
+        yield cached
+        return
+
+    answer = ""
+    if needs_planner(question):
+        # Portia runs only produce the answer once the whole plan has run
+        answer = get_planner_answer(question) or ""
+        if answer:
+            yield answer
+    else:
+        for delta in stream_rag_answer(question):
+            answer += delta
+            yield delta
+    if answer:
+        answer_cache.put(question, answer)
+
+
+def stream_rag_answer(question: str) -> Iterator[str]:
+    """Answer a question from the docs with a single retrieval and a single streamed LLM call."""
+    with stage("retrieval"):
+        passages = rag_tool.retrieve([question])
+    if not passages:
+        return
+    messages = RETRIEVAL_PROMPT.format_messages(
+        question=question,
+        context=format_context(passages),
+    )
+    for chunk in timed_iter("generation", llm.stream(messages)):
+        if chunk.content:
+            yield str(chunk.content)
+
+
+def get_planner_answer(question: str) -> str | None:
+    """Answer a question with a full Portia run, which can use any tool in the registry."""
     full_question = (
         "Please use the Portia SDK knowledge docs from the RAG DB to answer the following "
         f"question: {question}. Write a summary of the answer in under 2000 characters. "
     )
-    run = portia.run(full_question)
+    with stage("planning"):
+        plan = portia.plan(full_question)
+    with stage("execution"):
+        run = portia.run_plan(plan)
     if run.state == PlanRunState.NEED_CLARIFICATION or run.state == PlanRunState.FAILED:
         return None
     if run.outputs.final_output:
@@ -43,4 +129,4 @@ if __name__ == "__main__":
     try:
         print(get_answer("What types of storage class can I use with the Porita SDK?"))
     finally:
-        close_weaviate()
+        close_retrieval_backend()
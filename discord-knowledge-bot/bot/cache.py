@@ -0,0 +1,138 @@
+"""Semantic cache of answers to previously asked questions.
+
+Questions are normalised and embedded, and a cached answer is returned if a previous question's
+embedding is within a cosine similarity threshold. Entries expire after a TTL and the least
+recently used entries are evicted once the cache is full. The whole cache is invalidated when
+the loader re-ingests the docs, which it signals by touching the index version file.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+INDEX_VERSION_PATH = os.path.join("vector_store", "index_version")
+
+
+def bump_index_version():
+    """Signal to any running bots that the docs have been re-ingested."""
+    os.makedirs(os.path.dirname(INDEX_VERSION_PATH), exist_ok=True)
+    with open(INDEX_VERSION_PATH, "w") as f:
+        f.write(str(time.time()))
+
+
+def _index_version() -> str | None:
+    try:
+        with open(INDEX_VERSION_PATH) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def normalise_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().strip("?!. ").lower()
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    answer: str
+    created_at: float
+
+
+class AnswerCache:
+    """Thread-safe semantic LRU cache of answers."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.92,
+        ttl: float = 24 * 60 * 60,
+        max_entries: int = 1000,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # Embeddings of recently missed questions, so put() doesn't need to embed them again
+        self._missed: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._index_version = _index_version()
+        self._lock = threading.Lock()
+
+    def get(self, question: str) -> str | None:
+        """Return the cached answer to the most similar previous question, if close enough."""
+        key = normalise_question(question)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return self._hit(key, 1.0)
+            if not self._entries:
+                self.misses += 1
+                return None
+
+        vector = self._embed(key)
+        with self._lock:
+            keys = list(self._entries)
+            if not keys:
+                self.misses += 1
+                return None
+            similarities = np.stack([self._entries[k].vector for k in keys]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                self._missed[key] = vector
+                if len(self._missed) > 128:
+                    self._missed.popitem(last=False)
+                print(f"Answer cache miss (best similarity {similarities[best]:.3f})")
+                return None
+            return self._hit(keys[best], float(similarities[best]))
+
+    def put(self, question: str, answer: str):
+        key = normalise_question(question)
+        with self._lock:
+            vector = self._missed.pop(key, None)
+        if vector is None:
+            vector = self._embed(key)
+        with self._lock:
+            self._entries[key] = _Entry(vector, answer, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def _hit(self, key: str, similarity: float) -> str:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        print(f"Answer cache hit (similarity {similarity:.3f})")
+        return self._entries[key].answer
+
+    def _expire(self):
+        """Drop expired entries, or everything if the docs have been re-ingested."""
+        index_version = _index_version()
+        if index_version != self._index_version:
+            self._index_version = index_version
+            self._entries.clear()
+            return
+        cutoff = time.monotonic() - self.ttl
+        for key in [k for k, e in self._entries.items() if e.created_at < cutoff]:
+            del self._entries[key]
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
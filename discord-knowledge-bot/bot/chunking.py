@@ -0,0 +1,228 @@
+"""Conversion and chunking of crawled pages.
+
+Pages are converted to markdown and split along their structure rather than at fixed character
+counts: chunks are built from whole paragraphs, lists and code blocks, and sized in tokens.
+A chunk never spans a heading unless the section before it is too small to stand on its own,
+and code blocks are only split if they don't fit in a chunk by themselves. Each chunk records
+the path of headings it falls under, along with its offset in the page's markdown.
+
+This module doesn't depend on any retrieval backend, so that it can be cheaply imported by the
+worker processes of the loader's process pool.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from markdownify import ATX
+from markdownify import markdownify as md
+from weaviate.util import generate_uuid5
+
+from bot.dedupe import chunk_hash, minhash
+from bot.tokens import count_tokens
+
+
+@dataclass(frozen=True)
+class ChunkSettings:
+    # Chunks are filled with blocks up to `max_tokens`...
+    max_tokens: int = 512
+    # ...and a new section only starts a new chunk once the current one has `min_tokens`
+    min_tokens: int = 128
+
+
+DEFAULT_CHUNK_SETTINGS = ChunkSettings()
+# Settings for sources starting with each prefix, the longest matching prefix taking precedence
+CHUNK_SETTINGS_BY_PREFIX: dict[str, ChunkSettings] = {
+    # The SDK reference is made up of long sections with large code examples
+    "https://docs.portialabs.ai/SDK/": ChunkSettings(max_tokens=800, min_tokens=200),
+}
+
+HEADING_REGEX = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+FENCE_REGEX = re.compile(r"^\s*(`{3,}|~{3,})")
+
+
+@dataclass
+class _Block:
+    """A paragraph, list, heading or code block, along with the headings it falls under."""
+
+    start: int
+    end: int
+    headings: tuple[str, ...]
+    starts_section: bool
+
+
+def chunk_settings_for(source: str) -> ChunkSettings:
+    matches = [prefix for prefix in CHUNK_SETTINGS_BY_PREFIX if source.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CHUNK_SETTINGS
+    return CHUNK_SETTINGS_BY_PREFIX[max(matches, key=len)]
+
+
+def _blocks(text: str) -> list[_Block]:
+    """Split markdown into blocks separated by blank lines, keeping code blocks whole."""
+    blocks = []
+    headings: list[tuple[int, str]] = []
+    start = None
+    fence = None
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        line_start, offset = offset, offset + len(line)
+        if fence is not None:
+            # Inside a code block, only its closing fence ends it
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        if match := FENCE_REGEX.match(line):
+            fence = match.group(1)
+            if start is None:
+                start = line_start
+            continue
+        if match := HEADING_REGEX.match(line):
+            if start is not None:
+                blocks.append(_Block(start, line_start, _path(headings), False))
+            level = len(match.group(1))
+            headings = [(lvl, title) for lvl, title in headings if lvl < level]
+            headings.append((level, match.group(2)))
+            blocks.append(_Block(line_start, offset, _path(headings), True))
+            start = None
+        elif not line.strip():
+            if start is not None:
+                blocks.append(_Block(start, line_start, _path(headings), False))
+            start = None
+        elif start is None:
+            start = line_start
+    if start is not None:
+        blocks.append(_Block(start, offset, _path(headings), False))
+    return blocks
+
+
+def _path(headings: list[tuple[int, str]]) -> tuple[str, ...]:
+    return tuple(title for _, title in headings)
+
+
+def split_markdown(
+    text: str, settings: ChunkSettings = DEFAULT_CHUNK_SETTINGS
+) -> list[tuple[int, str, tuple[str, ...]]]:
+    """Split markdown into (start offset, text, heading path) chunks of at most `max_tokens`."""
+    chunks = []
+    current: list[_Block] = []
+    current_tokens = 0
+
+    def flush(carry: _Block | None = None):
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(_chunk(text, current[0].start, current[-1].end, current[0].headings))
+        current = [carry] if carry is not None else []
+        current_tokens = count_tokens(text[carry.start : carry.end]) if carry is not None else 0
+
+    for block in _blocks(text):
+        tokens = count_tokens(text[block.start : block.end])
+        if tokens > settings.max_tokens:
+            # Too big for a chunk of its own, so it has to be split. If the current chunk is too
+            # small to stand on its own (e.g. just a heading), it's split along with the block.
+            if current and current_tokens < settings.min_tokens:
+                start, headings = current[0].start, current[0].headings
+                current, current_tokens = [], 0
+            else:
+                flush()
+                start, headings = block.start, block.headings
+            *splits, (last_start, last, _) = _split_text(
+                text, start, block.end, headings, settings
+            )
+            chunks.extend(splits)
+            # Leave room for what follows the block in its last piece
+            current = [_Block(last_start, last_start + len(last), headings, False)]
+            current_tokens = count_tokens(last)
+            continue
+        if current and current_tokens + tokens > settings.max_tokens:
+            # Don't leave a heading at the end of a chunk, apart from the section it heads
+            heading = current[-1] if current[-1].starts_section and len(current) > 1 else None
+            if heading is not None:
+                current.pop()
+            flush(heading)
+        elif current and block.starts_section and current_tokens >= settings.min_tokens:
+            flush()
+        current.append(block)
+        current_tokens += tokens
+    flush()
+    return [chunk for chunk in chunks if chunk[1]]
+
+
+def _chunk(text: str, start: int, end: int, headings: tuple[str, ...]):
+    """The chunk for text[start:end], with surrounding whitespace stripped."""
+    chunk = text[start:end]
+    stripped = chunk.lstrip()
+    return start + len(chunk) - len(stripped), stripped.rstrip(), headings
+
+
+def _split_text(
+    text: str, start: int, end: int, headings: tuple[str, ...], settings: ChunkSettings
+):
+    """Split text[start:end] at the largest separators (blank lines, lines, words) that fit."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.max_tokens,
+        chunk_overlap=0,
+        length_function=count_tokens,
+        add_start_index=True,
+    )
+    for split in splitter.create_documents([text[start:end]]):
+        split_start = start + split.metadata["start_index"]
+        yield _chunk(text, split_start, split_start + len(split.page_content), headings)
+
+
+def to_markdown(html: str) -> str:
+    markdown = md(html, heading_style=ATX)
+    # Collapse runs of blank lines, so consecutive chunks are at most a blank line apart
+    return re.sub(r"\n\s*\n(\s*\n)+", "\n\n", markdown)
+
+
+def split_document(doc: Document) -> list[Document]:
+    """Convert a crawled HTML page to markdown and split it into chunks."""
+    source = doc.metadata["source"]
+    return [
+        Document(
+            page_content=chunk,
+            metadata={
+                **doc.metadata,
+                "start_index": start,
+                "heading_path": " > ".join(headings),
+            },
+        )
+        for start, chunk, headings in split_markdown(
+            to_markdown(doc.page_content), chunk_settings_for(source)
+        )
+    ]
+
+
+def split_page(
+    doc: Document, fingerprint: bool
+) -> tuple[str, list[Document], np.ndarray | None, list[str]]:
+    """Split a page, along with its MinHash signature and chunk hashes if `fingerprint` is set.
+
+    This is what the loader's worker processes run, so it must stay importable (and picklable)
+    without the rest of the bot.
+    """
+    splits = split_document(doc)
+    if not fingerprint:
+        return doc.metadata["source"], splits, None, []
+    # Signatures are over sets of shingles, so it doesn't matter if chunks overlap
+    signature = minhash("\n".join(split.page_content for split in splits))
+    return doc.metadata["source"], splits, signature, [chunk_hash(s.page_content) for s in splits]
+
+
+def chunk_uuid(source: str, index: int) -> str:
+    """Deterministic ID for the `index`th chunk of a page, so re-inserting a page overwrites it."""
+    return generate_uuid5(f"{source}#{index}")
+
+
+def chunk_objects(source: str, splits: list[Document]) -> list[tuple[str, dict]]:
+    """Objects (keyed by their deterministic UUID) to store for the chunks of a page."""
+    return [
+        (
+            chunk_uuid(source, i),
+            {"text": split.page_content, "metadata": {**split.metadata, "chunk_index": i}},
+        )
+        for i, split in enumerate(splits)
+    ]
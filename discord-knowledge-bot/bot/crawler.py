@@ -0,0 +1,279 @@
+"""Async crawler for loading docs sites.
+
+Pages are fetched concurrently through a pooled HTTP client, with a limit on the number of
+in-flight requests per host. The crawl is seeded from the site's sitemap (if it has one) and
+then follows links within the site, like `RecursiveUrlLoader`. Responses are cached on disk
+along with their ETag / Last-Modified headers so that re-crawls can use conditional requests
+and only download pages that have changed.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from urllib.parse import urldefrag, urljoin, urlparse
+from xml.etree import ElementTree
+
+import httpx
+from langchain_core.documents import Document
+from langchain_core.utils.html import extract_sub_links
+
+CACHE_DIR = os.path.join("vector_store", "http_cache")
+TITLE_REGEX = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+
+class ResponseCache:
+    """On-disk cache of responses, keyed by URL."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def get(self, url: str) -> dict | None:
+        try:
+            with open(self._path(url)) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, url: str, response: httpx.Response) -> dict:
+        entry = {
+            "url": url,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_type": response.headers.get("content-type", ""),
+            "body": response.text,
+        }
+        # Write then rename so a crash mid-write can't leave a corrupt entry behind
+        path = self._path(url)
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+        return entry
+
+
+class Crawler:
+    """Crawls one or more docs sites concurrently."""
+
+    def __init__(
+        self,
+        max_depth: int = 2,
+        max_connections: int = 32,
+        per_host_limit: int = 8,
+        timeout: float = 10.0,
+        use_sitemap: bool = True,
+        cache: ResponseCache | None = None,
+        client: httpx.AsyncClient | None = None,
+    ):
+        self.max_depth = max_depth
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.use_sitemap = use_sitemap
+        self.cache = cache or ResponseCache()
+        self._client = client
+        self._host_limits: dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.per_host_limit)
+        )
+        self.stats = {"pages": 0, "fetched": 0, "not_modified": 0, "errors": 0}
+        # URLs that the server says no longer exist (404 or 410)
+        self.gone: set[str] = set()
+
+    async def stream(
+        self, domains: list[str], max_queued: int = 64
+    ) -> AsyncIterator[Document]:
+        """Crawl all the given domains, yielding a document per HTML page as it is fetched.
+
+        At most `max_queued` pages are buffered, so the crawl slows down to match the rate
+        that documents are consumed.
+        """
+        pages: asyncio.Queue[Document | None] = asyncio.Queue(maxsize=max_queued)
+
+        async def produce():
+            client = self._client or self._create_client()
+            start = time.perf_counter()
+            try:
+                await asyncio.gather(
+                    *(self._crawl_domain(client, domain, pages.put) for domain in domains)
+                )
+            finally:
+                if self._client is None:
+                    await client.aclose()
+                await pages.put(None)
+            print(
+                f"Crawled {self.stats['pages']} pages in {time.perf_counter() - start:.1f}s "
+                f"({self.stats['not_modified']} not modified, {self.stats['errors']} errors)"
+            )
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (doc := await pages.get()) is not None:
+                yield doc
+            await producer
+        finally:
+            producer.cancel()
+
+    async def crawl(self, domains: list[str]) -> list[Document]:
+        """Crawl all the given domains, returning a document per HTML page."""
+        return [doc async for doc in self.stream(domains)]
+
+    def cached_document(self, url: str) -> Document | None:
+        """The document for a page as it was last fetched, if it's cached."""
+        page = self.cache.get(url)
+        return None if page is None else _to_document(url, page)
+
+    async def check_gone(self, urls: list[str]) -> set[str]:
+        """Request the given URLs (e.g. pages the crawl didn't reach), returning those now gone.
+
+        Like pages found by the crawl, URLs that return 404 or 410 are also added to `gone`.
+        """
+        client = self._client or self._create_client()
+        try:
+            await asyncio.gather(*(self._fetch(client, url) for url in urls))
+        finally:
+            if self._client is None:
+                await client.aclose()
+        return self.gone.intersection(urls)
+
+    def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+
+    async def _crawl_domain(
+        self,
+        client: httpx.AsyncClient,
+        root: str,
+        emit: Callable[[Document], Awaitable[None]],
+    ):
+        root = root.rstrip("/") + "/"
+        seen = {root}
+        queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+        queue.put_nowait((root, 0))
+        if self.use_sitemap:
+            for url in await self._sitemap_urls(client, root):
+                if url not in seen:
+                    seen.add(url)
+                    queue.put_nowait((url, 1))
+
+        async def worker():
+            while True:
+                url, depth = await queue.get()
+                try:
+                    page = await self._fetch(client, url)
+                    if page is None or "text/html" not in page["content_type"]:
+                        continue
+                    await emit(_to_document(url, page))
+                    self.stats["pages"] += 1
+                    if depth + 1 >= self.max_depth:
+                        continue
+                    for link in extract_sub_links(
+                        page["body"],
+                        url,
+                        base_url=root,
+                        prevent_outside=True,
+                        continue_on_failure=True,
+                    ):
+                        link = urldefrag(link).url
+                        if link not in seen:
+                            seen.add(link)
+                            queue.put_nowait((link, depth + 1))
+                except Exception as e:
+                    print(f"Error crawling {url}: {e}")
+                    self.stats["errors"] += 1
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_connections)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def _sitemap_urls(self, client: httpx.AsyncClient, root: str) -> list[str]:
+        """Return the page URLs listed in the site's sitemap (following sitemap indexes)."""
+        urls = []
+        sitemaps = [urljoin(root, "sitemap.xml")]
+        while sitemaps:
+            page = await self._fetch(client, sitemaps.pop())
+            if page is None:
+                continue
+            try:
+                tree = ElementTree.fromstring(page["body"])
+            except ElementTree.ParseError:
+                continue
+            for element in tree.iter():
+                if not element.tag.endswith("loc") or not element.text:
+                    continue
+                loc = urldefrag(element.text.strip()).url
+                if not loc.startswith(root):
+                    continue
+                if tree.tag.endswith("sitemapindex"):
+                    sitemaps.append(loc)
+                else:
+                    urls.append(loc)
+        return urls
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> dict | None:
+        """Fetch a URL, using a conditional request if we have it cached."""
+        cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self._host_limits[urlparse(url).netloc]:
+            try:
+                response = await client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                print(f"Error fetching {url}: {e}")
+                self.stats["errors"] += 1
+                return cached
+
+        if response.status_code == 304 and cached is not None:
+            self.stats["not_modified"] += 1
+            return cached
+        if response.status_code in (404, 410):
+            self.gone.add(url)
+            return None
+        if response.status_code != 200:
+            # e.g. a 5xx or 429, so the page is probably still there
+            print(f"Error fetching {url}: HTTP {response.status_code}")
+            self.stats["errors"] += 1
+            return cached
+        self.stats["fetched"] += 1
+        return self.cache.put(url, response)
+
+
+def _to_document(url: str, page: dict) -> Document:
+    title = TITLE_REGEX.search(page["body"])
+    return Document(
+        page_content=page["body"],
+        metadata={
+            "source": url,
+            "title": title.group(1).strip() if title else "",
+            "content_type": page["content_type"],
+        },
+    )
+
+
+def crawl(domains: list[str], **kwargs) -> list[Document]:
+    """Crawl the given domains. Keyword arguments are passed through to `Crawler`."""
+    return asyncio.run(Crawler(**kwargs).crawl(domains))
@@ -0,0 +1,134 @@
+"""Near-duplicate page and repeated chunk elimination for the loader.
+
+The docs site has many pages that are (nearly) the same, such as versioned copies of a page and
+index pages that are mostly navigation, and every page repeats the same navigation and footer.
+Embedding all of these costs money, bloats the index and fills query results with copies of the
+same text, so before chunks reach the backend:
+- Pages whose MinHash signature is close to that of a page already loaded are dropped. Candidate
+  duplicates are found with locality-sensitive hashing (LSH) over bands of the signature, so each
+  page is only compared against the pages that share a band with it.
+- Chunks whose (normalised) text has already been loaded from another page are dropped, so
+  boilerplate is only stored once.
+
+Signatures and chunk hashes are computed in the loader's worker processes, while the
+`Deduplicator` itself runs in the main process.
+"""
+
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# The same permutations must be used by every worker process, so they are seeded
+_rng = np.random.default_rng(1)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """Hashes of the overlapping runs of `SHINGLE_SIZE` words in the text."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    # crc32 rather than hash(), which is salted differently in each process
+    return np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles if s),
+        dtype=np.uint64,
+        count=-1,
+    )
+
+
+def minhash(text: str) -> np.ndarray:
+    """The MinHash signature of the text's shingles, as `NUM_PERM` uint32s."""
+    hashes = _shingle_hashes(text)
+    if not len(hashes):
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    # Universal hashing, applying all the permutations to all the shingles at once
+    permuted = ((hashes[:, None] * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimate of the Jaccard similarity of the shingles behind two signatures."""
+    return float(np.mean(a == b))
+
+
+def chunk_hash(text: str) -> str:
+    """Hash of a chunk's text, ignoring case and whitespace."""
+    normalised = " ".join(text.lower().split())
+    return hashlib.sha1(normalised.encode("utf-8")).hexdigest()[:16]
+
+
+def _rows_per_band(threshold: float, num_perm: int) -> int:
+    """Choose the band size whose LSH threshold, (1 / bands) ^ (1 / rows), is nearest to ours."""
+    divisors = [rows for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    return min(divisors, key=lambda rows: abs((rows / num_perm) ** (1 / rows) - threshold))
+
+
+class Deduplicator:
+    """Tracks the pages and chunks loaded so far, to drop those that duplicate them."""
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = NUM_PERM):
+        self.threshold = threshold
+        self.rows = _rows_per_band(threshold, num_perm)
+        self.duplicate_pages = 0
+        self.duplicate_chunks = 0
+        self._buckets: dict[tuple[int, bytes], set[str]] = defaultdict(set)
+        self._signatures: dict[str, np.ndarray] = {}
+        self._chunk_owners: dict[str, str] = {}
+
+    def _bands(self, signature: np.ndarray):
+        for start in range(0, len(signature), self.rows):
+            yield start, signature[start : start + self.rows].tobytes()
+
+    def add(self, source: str, signature: np.ndarray, chunk_hashes: list[str]):
+        """Record a page and its chunks as loaded."""
+        self._signatures[source] = signature
+        for band in self._bands(signature):
+            self._buckets[band].add(source)
+        for hash_ in chunk_hashes:
+            self._chunk_owners.setdefault(hash_, source)
+
+    def owner(self, chunk_hash: str) -> str | None:
+        """The page a chunk was first loaded from."""
+        return self._chunk_owners.get(chunk_hash)
+
+    def find_duplicate(self, source: str, signature: np.ndarray) -> str | None:
+        """Return the most similar loaded page above the threshold, if there is one."""
+        candidates = {
+            other
+            for band in self._bands(signature)
+            for other in self._buckets.get(band, ())
+            if other != source
+        }
+        scores = {other: similarity(signature, self._signatures[other]) for other in candidates}
+        best = max(scores, key=scores.__getitem__, default=None)
+        return best if best is not None and scores[best] >= self.threshold else None
+
+    def dedupe_page(
+        self, source: str, signature: np.ndarray, chunk_hashes: list[str]
+    ) -> tuple[str | None, list[bool]]:
+        """Check a page against those loaded so far, and record it if it is new.
+
+        Returns the page it is a near-duplicate of (if any), and which of its chunks to keep.
+        """
+        duplicate_of = self.find_duplicate(source, signature)
+        if duplicate_of is not None:
+            self.duplicate_pages += 1
+            return duplicate_of, [False] * len(chunk_hashes)
+        keep = []
+        seen = set()
+        for hash_ in chunk_hashes:
+            keep.append(hash_ not in seen and self._chunk_owners.get(hash_, source) == source)
+            seen.add(hash_)
+        self.duplicate_chunks += keep.count(False)
+        self.add(source, signature, [h for h, kept in zip(chunk_hashes, keep) if kept])
+        return None, keep
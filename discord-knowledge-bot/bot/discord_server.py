@@ -1,12 +1,29 @@
+import asyncio
 import os
+import time
 
 import discord
 from dotenv import load_dotenv
 
-from bot.ask import get_answer
+from bot.ask import answer_cache, stream_answer
+from bot.embeddings import CachedQueryEmbeddings
+from bot.messages import split_message
+from bot.metrics import ASK_SECONDS, ASKS, DISCORD_SECONDS, observe_stages, start_metrics_server
+from bot.retrieval import get_retrieval_backend
+from bot.workers import AskQueue, Job, QueueFullError, RateLimitedError, RateLimiter
 
 load_dotenv(override=True)
 bot = discord.Bot()
+EDIT_INTERVAL = float(os.getenv("DISCORD_EDIT_INTERVAL_SECONDS", "1"))
+ask_queue = AskQueue(
+    observe_stages(stream_answer),
+    workers=int(os.getenv("ASK_WORKERS", "4")),
+    max_pending=int(os.getenv("ASK_MAX_PENDING", "32")),
+    user_limiter=RateLimiter(limit=int(os.getenv("ASK_USER_LIMIT_PER_MINUTE", "3")), window=60),
+    channel_limiter=RateLimiter(
+        limit=int(os.getenv("ASK_CHANNEL_LIMIT_PER_MINUTE", "20")), window=60
+    ),
+)
 
 
 @bot.event
@@ -27,22 +44,106 @@ async def hello(ctx: discord.ApplicationContext):
     guild_ids=[os.getenv("DISCORD_SERVER_ID")],
 )
 async def ask(ctx: discord.ApplicationContext, question: str):
+    start = time.perf_counter()
     await ctx.defer()
     if str(ctx.channel_id) != os.getenv("DISCORD_CHANNEL_ID"):
         await ctx.respond("Sorry, this command can't be used in this channel.")
         return
-    response = get_answer(question)
-    if response is None:
-        await ctx.respond("Sorry, I wasn't able to find an answer.")
+    try:
+        job = ask_queue.submit(question, ctx.author.id, ctx.channel_id)
+    except RateLimitedError as e:
+        ASKS.labels("rate_limited").inc()
+        await ctx.respond(
+            f"You're asking questions too quickly - please try again in {e.retry_after:.0f}s."
+        )
+        return
+    except QueueFullError:
+        ASKS.labels("queue_full").inc()
+        await ctx.respond("Sorry, I'm answering too many questions right now - please try again later.")
         return
-    await ctx.respond("Question: " + question)
-    # There is a 2000 character limit on Discord messages
-    if len(response) > 1500:
-        l, r = response[1500:1600].split(" ", maxsplit=1)
-        await ctx.respond(response[:1500] + l + "...")
-        await ctx.respond("..." + r + response[1600:])
-    else:
-        await ctx.respond(response)
+
+    with DISCORD_SECONDS.labels("send").time():
+        await ctx.respond("Question: " + question)
+    await stream_answer_to_discord(ctx, job)
+    ASK_SECONDS.observe(time.perf_counter() - start)
+
+
+class StreamedReply:
+    """A reply that is edited as it grows, spilling over into extra messages when needed."""
+
+    def __init__(self, ctx: discord.ApplicationContext):
+        self.ctx = ctx
+        self.messages = []
+        self.contents: list[str] = []
+
+    async def show(self, text: str):
+        chunks = split_message(text)
+        for i, chunk in enumerate(chunks):
+            if i >= len(self.messages):
+                with DISCORD_SECONDS.labels("send").time():
+                    self.messages.append(await self.ctx.respond(chunk))
+                self.contents.append(chunk)
+            elif chunk != self.contents[i]:
+                with DISCORD_SECONDS.labels("edit").time():
+                    await self.messages[i].edit(content=chunk)
+                self.contents[i] = chunk
+        # The text can get shorter (e.g. when it's replaced by an error message), so remove any
+        # messages that are left over from a longer version
+        for message in self.messages[len(chunks):]:
+            with DISCORD_SECONDS.labels("delete").time():
+                await message.delete()
+        del self.messages[len(chunks):]
+        del self.contents[len(chunks):]
 
 
+async def stream_answer_to_discord(ctx: discord.ApplicationContext, job: Job):
+    """Show a queued question's position in the queue, and then its answer as it streams in.
+
+    Discord rate limits message edits, so the reply is edited at most once every
+    `EDIT_INTERVAL` seconds.
+    """
+    reply = StreamedReply(ctx)
+    shown = None
+    while not job.future.done():
+        if job.text:
+            text = job.text + " ..."
+        elif position := ask_queue.position(job):
+            text = f"You're number {position} in the queue..."
+        else:
+            text = "Working on it..."
+        if text != shown:
+            await reply.show(text)
+            shown = text
+        last_edit = time.monotonic()
+
+        # Wake up as soon as there's new text or the answer is done...
+        job.updated.clear()
+        updated = asyncio.ensure_future(job.updated.wait())
+        await asyncio.wait(
+            [job.future, updated], timeout=2, return_when=asyncio.FIRST_COMPLETED
+        )
+        updated.cancel()
+        # ...but don't edit the reply again until the interval has passed
+        wait = last_edit + EDIT_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.wait([job.future], timeout=wait)
+
+    try:
+        answer = job.future.result()
+        ASKS.labels("answered" if answer else "no_answer").inc()
+    except Exception as e:
+        print(f"Error answering question: {e}")
+        ASKS.labels("error").inc()
+        answer = None
+    await reply.show(answer or "Sorry, I wasn't able to find an answer.")
+
+
+if metrics_port := os.getenv("METRICS_PORT", "9464"):
+    caches = {"answer": answer_cache}
+    query_embeddings = get_retrieval_backend().query_embeddings()
+    if isinstance(query_embeddings, CachedQueryEmbeddings):
+        caches["query_embedding"] = query_embeddings
+    start_metrics_server(
+        int(metrics_port), queue_depth=lambda: ask_queue.depth, caches=caches
+    )
 bot.run(os.getenv("DISCORD_BOT_TOKEN"))  # run the bot with the token
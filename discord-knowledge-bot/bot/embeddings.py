@@ -0,0 +1,134 @@
+"""Query embeddings, with a persistent cache.
+
+The same questions (and retrieval queries) come up again and again, so query embeddings are
+cached in SQLite, keyed by the normalised text and the embedding model and dimensions. Once the
+cache is full, the least recently used embeddings are evicted.
+
+To keep disk writes off the query path, the last-used times of cache hits are written in
+batches, and evictions happen once the cache has grown a margin past its limit.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from bot.cache import normalise_question
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 1024  # Choose from 256, 1024, or 3072
+QUERY_EMBEDDING_CACHE_PATH = os.path.join("vector_store", "query_embeddings.sqlite")
+# Cache hits between writes of their last-used times
+LAST_USED_FLUSH_INTERVAL = 100
+# How far past `max_entries` the cache can grow before the oldest entries are evicted
+EVICTION_MARGIN = 0.1
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wraps an embedding model, caching the embeddings of queries on disk."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        dimensions: int,
+        path: str = QUERY_EMBEDDING_CACHE_PATH,
+        max_entries: int = 100_000,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        # Last-used times of cache hits that haven't been written yet, by key
+        self._last_used: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model}:{self.dimensions}:{text}".encode("utf-8")
+        ).hexdigest()
+
+    def embed_query(self, text: str) -> list[float]:
+        text = normalise_question(text)
+        key = self._key(text)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                self._last_used[key] = time.time()
+                if len(self._last_used) >= LAST_USED_FLUSH_INTERVAL:
+                    self._flush_last_used()
+                    self._db.commit()
+                return np.frombuffer(row[0], dtype=np.float32).tolist()
+            self.misses += 1
+
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                (key, vector.tobytes(), time.time()),
+            )
+            self._count += 1
+            if self._count > self.max_entries * (1 + EVICTION_MARGIN):
+                # Evict by up-to-date last-used times
+                self._flush_last_used()
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                    "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._db.commit()
+        return vector.tolist()
+
+    def _flush_last_used(self):
+        """Write the pending last-used times (the caller holds the lock and commits)."""
+        self._db.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._last_used.items()],
+        )
+        self._last_used.clear()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_query_embeddings: CachedQueryEmbeddings | None = None
+_query_embeddings_lock = threading.Lock()
+
+
+def get_query_embeddings() -> CachedQueryEmbeddings:
+    """Return the shared, cached embedding model matching the Weaviate vectoriser."""
+    global _query_embeddings
+    with _query_embeddings_lock:
+        if _query_embeddings is None:
+            _query_embeddings = CachedQueryEmbeddings(
+                OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS),
+                model=EMBEDDING_MODEL,
+                dimensions=EMBEDDING_DIMENSIONS,
+                max_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+            )
+        return _query_embeddings
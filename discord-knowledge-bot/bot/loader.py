@@ -1,27 +1,335 @@
-from dotenv import load_dotenv
-from langchain_community.document_loaders import RecursiveUrlLoader
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import multiprocessing
+import queue
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import compress
 
-from bot.weaviate import close_weaviate, insert_docs_into_weaviate
+import numpy as np
+from dotenv import load_dotenv
+from bot.cache import bump_index_version
+from bot.chunking import chunk_objects, split_page
+from bot.crawler import Crawler
+from bot.dedupe import Deduplicator
+from bot.retrieval import close_retrieval_backend, get_retrieval_backend
 
 load_dotenv(override=True)
 
+MANIFEST_PATH = os.path.join("vector_store", "manifest.json")
+
+
+def load_manifest() -> dict[str, dict]:
+    """Load the record of what has been loaded for each source from a previous run."""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict[str, dict]):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def load_docs(
+    domains: list[str],
+    batch_size: int | None = None,
+    concurrent_requests: int = 2,
+    incremental: bool = False,
+    max_depth: int = 2,
+    workers: int | None = None,
+    queue_size: int = 64,
+    dedupe_threshold: float | None = 0.9,
+):
+    """Load the Portia SDK docs into the retrieval backend selected by `RAG_BACKEND`.
+
+    The load runs as a streaming pipeline: pages are converted and split in a process pool as
+    they are crawled, and their chunks are inserted into the backend as they are split. Each stage
+    is connected to the next by a queue of at most `queue_size` items, so memory use stays flat
+    regardless of the size of the site.
+
+    A manifest of the content hash and chunk IDs of each page is kept between runs. In
+    incremental mode, pages whose content hasn't changed since the last run are skipped. In
+    both modes, stale chunks from changed pages are deleted, as are the chunks of pages that no
+    longer exist (that return 404 or 410, whether or not they're still linked to), as long as
+    nothing failed to fetch.
+
+    Pages that are near-duplicates (with an estimated similarity of at least `dedupe_threshold`)
+    of a page already loaded are dropped, as are chunks repeated from other pages. Set
+    `dedupe_threshold` to None to load everything. In incremental mode, unchanged pages that were
+    dropped (in whole or in part) in favour of a page that has since changed or gone are reloaded.
+    """
+    backend = get_retrieval_backend()
+    previous = load_manifest()
+    crawler = Crawler(max_depth=max_depth)
+    manifest = asyncio.run(
+        _run_pipeline(
+            list(domains),
+            previous,
+            crawler,
+            incremental=incremental,
+            workers=workers or os.cpu_count(),
+            queue_size=queue_size,
+            deduplicator=None if dedupe_threshold is None else Deduplicator(dedupe_threshold),
+            insert=partial(
+                backend.insert_chunks,
+                batch_size=batch_size,
+                concurrent_requests=concurrent_requests,
+            ),
+        )
+    )
+
+    # Pages missing from this crawl may have been deleted from the site (and so no longer be
+    # linked to), or may just have failed to fetch, so they're requested again. They're only
+    # removed if the server says they're gone (404 or 410), and only if nothing failed, in case
+    # the site was having an outage. Otherwise, their previous entries are carried forward.
+    unseen = sorted(set(previous) - set(manifest))
+    gone = asyncio.run(crawler.check_gone(unseen)) if unseen else set()
+    removed = set()
+    for source in unseen:
+        if source in gone and crawler.stats["errors"] == 0:
+            removed.add(source)
+        else:
+            manifest[source] = previous[source]
+
+    live_ids = {id_ for entry in manifest.values() for id_ in entry["chunk_ids"]}
+    stale_ids = [
+        id_
+        for entry in previous.values()
+        for id_ in entry["chunk_ids"]
+        if id_ not in live_ids
+    ]
+    print(f"Deleting {len(stale_ids)} stale chunks ({len(removed)} removed pages).")
+    backend.delete_chunks(stale_ids)
+    save_manifest(manifest)
+    bump_index_version()
 
-def load_docs_into_weaviate(domains: list[str]):
-    """Load the Portia SDK docs into a vector database."""
 
-    all_docs = []
-    for domain in domains:
-        loader = RecursiveUrlLoader(url=domain)
-        docs = loader.load()
-        all_docs.extend(docs)
-    for doc in all_docs:
-        doc.id = doc.metadata["source"]
-    insert_docs_into_weaviate(all_docs)
+async def _run_pipeline(
+    domains: list[str],
+    previous: dict[str, dict],
+    crawler: Crawler,
+    incremental: bool,
+    workers: int,
+    queue_size: int,
+    deduplicator: Deduplicator | None,
+    insert: Callable[[Iterable[tuple[str, dict]]], set[str]],
+) -> dict[str, dict]:
+    """Crawl -> markdownify & split (process pool) -> dedupe -> insert (thread).
+
+    Returns the manifest.
+    """
+    loop = asyncio.get_running_loop()
+    manifest = {}
+    unchanged: set[str] = set()
+
+    # The inserter runs in its own thread, pulling the chunks for one page at a time off a
+    # bounded queue. When it falls behind, putting onto the queue blocks, which stops us taking
+    # more pages from the crawler, which in turn pauses the crawl.
+    chunk_queue: queue.Queue[list[tuple[str, dict]] | None] = queue.Queue(
+        maxsize=queue_size
+    )
+
+    def queued_chunks() -> Iterator[tuple[str, dict]]:
+        while (page_objects := chunk_queue.get()) is not None:
+            yield from page_objects
+
+    inserter = loop.run_in_executor(None, insert, queued_chunks())
+
+    async def put(item: list[tuple[str, dict]] | None) -> None:
+        # If the inserter has stopped (e.g. the backend is down), nothing will drain the queue,
+        # so rather than blocking forever, raise its exception
+        while True:
+            if inserter.done():
+                inserter.result()
+                raise RuntimeError("The inserter stopped before all the chunks were queued")
+            try:
+                chunk_queue.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.wait({inserter}, timeout=0.1)
+
+    async def emit(split_task: asyncio.Future) -> None:
+        source, splits, signature, chunk_hashes = await split_task
+        page_objects = chunk_objects(source, splits)
+        if deduplicator is not None:
+            duplicate_of, keep = deduplicator.dedupe_page(source, signature, chunk_hashes)
+            page_objects = list(compress(page_objects, keep))
+            manifest[source]["signature"] = signature.tobytes().hex()
+            manifest[source]["chunk_hashes"] = list(compress(chunk_hashes, keep))
+            if duplicate_of is not None:
+                manifest[source]["duplicate_of"] = duplicate_of
+            # Record which pages kept the chunks that were dropped, in case they change or go
+            repeated_from = {
+                hash_: owner
+                for hash_, kept in zip(chunk_hashes, keep)
+                if not kept and (owner := deduplicator.owner(hash_)) != source
+            }
+            if duplicate_of is None and repeated_from:
+                manifest[source]["repeated_from"] = repeated_from
+        manifest[source]["chunk_ids"] = [uuid for uuid, _ in page_objects]
+        await put(page_objects)
+
+    try:
+        # Workers are spawned rather than forked, as by now the inserter thread and the backend's
+        # client (and its gRPC channel) are running, which aren't safe to fork
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            pending: set[asyncio.Future] = set()
+            async for doc in crawler.stream(domains, max_queued=queue_size):
+                source = doc.metadata["source"]
+                page_hash = content_hash(doc.page_content)
+                entry = previous.get(source)
+                if incremental and entry is not None and entry["hash"] == page_hash:
+                    manifest[source] = entry
+                    unchanged.add(source)
+                    # Seed the deduplicator with what the skipped page loaded last time
+                    if (
+                        deduplicator is not None
+                        and "signature" in entry
+                        and "duplicate_of" not in entry
+                    ):
+                        deduplicator.add(
+                            source,
+                            np.frombuffer(bytes.fromhex(entry["signature"]), dtype=np.uint32),
+                            entry["chunk_hashes"],
+                        )
+                    continue
+                manifest[source] = {"hash": page_hash, "chunk_ids": []}
+                pending.add(
+                    loop.run_in_executor(pool, split_page, doc, deduplicator is not None)
+                )
+                # Keep each worker busy without letting converted pages pile up in memory
+                if len(pending) >= 2 * workers:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        await emit(task)
+            for task in asyncio.as_completed(pending):
+                await emit(task)
+
+            if deduplicator is not None and incremental:
+                # Unchanged pages whose content was dropped in favour of a page that has since
+                # changed or gone would lose it, so they are reloaded from the response cache
+                stale = _stale_dependents(manifest, unchanged)
+                unchanged -= stale
+                pending = set()
+                for source in sorted(stale):
+                    doc = crawler.cached_document(source)
+                    if doc is None:
+                        # Force the page to be reloaded on the next run
+                        manifest[source]["hash"] = None
+                        continue
+                    manifest[source] = {"hash": manifest[source]["hash"], "chunk_ids": []}
+                    pending.add(loop.run_in_executor(pool, split_page, doc, True))
+                for task in asyncio.as_completed(pending):
+                    await emit(task)
+    finally:
+        if not inserter.done():
+            await put(None)
+        failed_ids = await inserter
+
+    print(f"Loaded {len(manifest) - len(unchanged)} pages, skipped {len(unchanged)} unchanged.")
+    if deduplicator is not None:
+        print(
+            f"Dropped {deduplicator.duplicate_pages} near-duplicate pages and "
+            f"{deduplicator.duplicate_chunks} repeated chunks."
+        )
+    for entry in manifest.values():
+        if failed_ids.intersection(entry["chunk_ids"]):
+            # Force the page to be reloaded on the next run
+            entry["hash"] = None
+    return manifest
+
+
+def _stale_dependents(manifest: dict[str, dict], unchanged: set[str]) -> set[str]:
+    """Unchanged pages that were dropped as near-duplicates of, or had chunks dropped as repeats
+    of, a page that has since changed or gone (or that is itself stale)."""
+    stale: set[str] = set()
+    while True:
+        valid = unchanged - stale
+        newly_stale = {
+            source
+            for source in valid
+            if manifest[source].get("duplicate_of", source) not in valid
+            or any(
+                owner not in manifest
+                or owner in stale
+                or hash_ not in manifest[owner].get("chunk_hashes", ())
+                for hash_, owner in manifest[source].get("repeated_from", {}).items()
+            )
+        }
+        if not newly_stale:
+            return stale
+        stale |= newly_stale
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Portia SDK docs into the vector database.")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Number of chunks per batch. Uses Weaviate's dynamic batching if not set.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="Number of concurrent batch requests (only used with --batch-size).",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only load pages that have changed since the last run.",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=2,
+        help="Maximum depth of links to follow from each domain (and its sitemap).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes used to convert and split pages. Defaults to one per core.",
+    )
+    parser.add_argument(
+        "--dedupe-threshold",
+        type=float,
+        default=0.9,
+        help="Similarity above which a page is dropped as a near-duplicate of another.",
+    )
+    parser.add_argument(
+        "--no-dedupe",
+        action="store_true",
+        help="Load near-duplicate pages and repeated chunks.",
+    )
+    args = parser.parse_args()
+
     domains = {"https://docs.portialabs.ai"}
     try:
-        load_docs_into_weaviate(domains)
+        load_docs(
+            domains,
+            batch_size=args.batch_size,
+            concurrent_requests=args.concurrency,
+            incremental=args.incremental,
+            max_depth=args.max_depth,
+            workers=args.workers,
+            dedupe_threshold=None if args.no_dedupe else args.dedupe_threshold,
+        )
     finally:
-        close_weaviate()
+        close_retrieval_backend()
@@ -0,0 +1,333 @@
+"""In-process vector index, for running the bot without Weaviate or an embedding API.
+
+Chunks are embedded with a local sentence-transformers model and their embeddings are stored in
+a memory-mapped float32 matrix on disk, so the index doesn't need to fit in RAM and is shared
+between processes through the page cache. For larger indexes, an inverted file (IVF) index is
+built with k-means: queries are only compared against the chunks in the `nprobe` clusters whose
+centroids are closest to the query, rather than every chunk. Chunks added since the IVF index
+was built are searched exhaustively, until there are enough of them to be worth rebuilding it.
+"""
+
+import json
+import os
+import threading
+from collections.abc import Iterable, Iterator
+from itertools import islice
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from bot.metrics import VECTOR_QUERY_SECONDS
+from bot.retrieval import Hit, RetrievalBackend
+
+try:
+    from sentence_transformers import SentenceTransformer
+
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+LOCAL_INDEX_DIR = os.path.join("vector_store", "local_index")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+# Below this many chunks, an exact search over every chunk is faster than using the IVF index
+MIN_IVF_SIZE = 2000
+# The IVF index is rebuilt once the chunks added since it was built are this fraction of the index
+IVF_REBUILD_FRACTION = 0.1
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Embeddings from a local sentence-transformers model."""
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL):
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise ImportError(
+                "The local backend needs sentence-transformers: "
+                "`pip install sentence-transformers`"
+            )
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.model.encode(texts, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class LocalIndex:
+    """A memory-mapped matrix of normalised embeddings, with an optional IVF index."""
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR):
+        self.path = path
+        self.dim: int | None = None
+        self.model: str | None = None
+        self.count = 0
+        self.chunks: list[dict | None] = []
+        self.rows: dict[str, int] = {}
+        self.vectors: np.ndarray | None = None
+        self.centroids: np.ndarray | None = None
+        self.lists: list[np.ndarray] = []
+        self.unindexed: list[int] = []
+        if os.path.exists(self._file("meta.json")):
+            self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def size(self) -> int:
+        """The number of live (i.e. not deleted) chunks."""
+        return len(self.rows)
+
+    def _load(self):
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        self.dim, self.model, self.count = meta["dim"], meta["model"], meta["count"]
+        with open(self._file("chunks.jsonl")) as f:
+            self.chunks = [json.loads(line) for line in f]
+        self.rows = {c["id"]: row for row, c in enumerate(self.chunks) if c is not None}
+        self._map_vectors()
+        if os.path.exists(self._file("ivf.npz")):
+            ivf = np.load(self._file("ivf.npz"))
+            self.centroids = ivf["centroids"]
+            offsets = ivf["offsets"]
+            self.lists = np.split(ivf["rows"], offsets[1:-1])
+        if os.path.exists(self._file("unindexed.npy")):
+            self.unindexed = np.load(self._file("unindexed.npy")).tolist()
+
+    def _map_vectors(self, min_rows: int = 0):
+        """Memory-map the vectors file, growing it to hold at least `min_rows` rows."""
+        path = self._file("vectors.f32")
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        capacity = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if min_rows > capacity:
+            capacity = max(min_rows, 2 * capacity, 1024)
+            self.vectors = None
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        if capacity:
+            self.vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def upsert(self, ids: list[str], chunks: list[dict], vectors: np.ndarray, model: str):
+        """Insert or overwrite chunks and their (normalised) embeddings."""
+        if self.dim is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.dim = vectors.shape[1]
+            self.model = model
+        elif model != self.model or vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Index was built with {self.model} ({self.dim} dims), not {model} "
+                f"({vectors.shape[1]} dims). Delete {self.path} to rebuild it."
+            )
+        self._map_vectors(self.count + len(ids))
+        for id_, chunk, vector in zip(ids, chunks, vectors):
+            row = self.rows.get(id_)
+            if row is None:
+                row = self.count
+                self.count += 1
+                self.chunks.append(None)
+                self.rows[id_] = row
+            # New and overwritten rows are searched exhaustively until the IVF index is rebuilt
+            self.unindexed.append(row)
+            self.chunks[row] = {"id": id_, **chunk}
+            self.vectors[row] = vector
+
+    def delete(self, ids: list[str]):
+        for id_ in ids:
+            row = self.rows.pop(id_, None)
+            if row is not None:
+                self.chunks[row] = None
+
+    def save(self):
+        """Write everything to disk, compacting and rebuilding the IVF index if it's due."""
+        if self.dim is None:
+            return
+        compacted = self.count - self.size > max(self.count // 5, 100)
+        if compacted:
+            self._compact()
+        self.vectors.flush()
+        # Compacting renumbers the rows, so the IVF index always needs rebuilding afterwards
+        if compacted or self._ivf_outdated():
+            self._build_ivf()
+        elif self.centroids is None:
+            # Every chunk is searched without an IVF index anyway
+            self.unindexed = []
+        with open(self._file("unindexed.npy.tmp"), "wb") as f:
+            np.save(f, np.array(self.unindexed, dtype=np.int64))
+        os.replace(self._file("unindexed.npy.tmp"), self._file("unindexed.npy"))
+        with open(self._file("chunks.jsonl.tmp"), "w") as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk) + "\n")
+        os.replace(self._file("chunks.jsonl.tmp"), self._file("chunks.jsonl"))
+        # meta.json is written last, as readers use it to detect that the index has changed
+        with open(self._file("meta.json.tmp"), "w") as f:
+            json.dump({"dim": self.dim, "model": self.model, "count": self.count}, f)
+        os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+
+    def _compact(self):
+        live = sorted(self.rows.values())
+        path = self._file("vectors.f32")
+        compacted = np.memmap(
+            path + ".tmp", dtype=np.float32, mode="w+", shape=(max(len(live), 1), self.dim)
+        )
+        for start in range(0, len(live), 8192):
+            block = live[start : start + 8192]
+            compacted[start : start + len(block)] = self.vectors[block]
+        compacted.flush()
+        del compacted
+        self.vectors = None
+        os.replace(path + ".tmp", path)
+        self.chunks = [self.chunks[row] for row in live]
+        self.rows = {chunk["id"]: row for row, chunk in enumerate(self.chunks)}
+        self.count = len(live)
+        self._map_vectors()
+
+    def _ivf_outdated(self) -> bool:
+        if self.centroids is None:
+            return self.size >= MIN_IVF_SIZE
+        return len(self.unindexed) > IVF_REBUILD_FRACTION * self.size
+
+    def _build_ivf(self, iterations: int = 10):
+        """Cluster the live vectors with spherical k-means to build the inverted lists."""
+        self.unindexed = []
+        live = np.fromiter(sorted(self.rows.values()), dtype=np.int64, count=self.size)
+        if len(live) < MIN_IVF_SIZE:
+            self.centroids, self.lists = None, []
+            if os.path.exists(self._file("ivf.npz")):
+                os.remove(self._file("ivf.npz"))
+            return
+        vectors = self.vectors[live]
+        n_lists = int(np.sqrt(len(live)))
+        rng = np.random.default_rng(42)
+        centroids = vectors[rng.choice(len(live), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _nearest_centroids(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Keep the old centroid for any empty clusters
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        assignments = _nearest_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = np.split(live[order], offsets[1:-1])
+        np.savez(
+            self._file("ivf.npz"), centroids=centroids, rows=live[order], offsets=offsets
+        )
+
+    def search(
+        self, vector: np.ndarray, limit: int, nprobe: int = 8, exact: bool = False
+    ) -> list[tuple[int, float]]:
+        """Return the (row, cosine similarity) of the `limit` chunks closest to `vector`."""
+        if not self.size:
+            return []
+        if exact or self.centroids is None:
+            rows = np.fromiter(self.rows.values(), dtype=np.int64, count=self.size)
+        else:
+            probes = np.argsort(self.centroids @ vector)[-nprobe:]
+            rows = np.concatenate(
+                [self.lists[p] for p in probes] + [np.array(self.unindexed, dtype=np.int64)]
+            )
+            # Lists can still hold rows that have since been deleted, and overwritten rows are
+            # both in a list and unindexed
+            rows = np.unique(rows)
+            rows = rows[[self.chunks[row] is not None for row in rows]]
+            if not len(rows):
+                return []
+        scores = self.vectors[rows] @ vector
+        top = np.argpartition(-scores, min(limit, len(rows)) - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + 8192] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), 8192)
+        ]
+    )
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class LocalBackend(RetrievalBackend):
+    """Retrieval backend using a `LocalIndex` and a local embedding model."""
+
+    def __init__(
+        self,
+        path: str = LOCAL_INDEX_DIR,
+        embeddings: Embeddings | None = None,
+        model_name: str = LOCAL_EMBEDDING_MODEL,
+        nprobe: int = 8,
+    ):
+        self.path = path
+        self.embeddings = embeddings or SentenceTransformerEmbeddings(model_name)
+        self.model_name = model_name
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._index = LocalIndex(path)
+        self._index_mtime = self._meta_mtime()
+
+    def _meta_mtime(self) -> float | None:
+        try:
+            return os.path.getmtime(os.path.join(self.path, "meta.json"))
+        except OSError:
+            return None
+
+    def _current_index(self) -> LocalIndex:
+        """The index, reloaded if another process (e.g. the loader) has changed it."""
+        mtime = self._meta_mtime()
+        if mtime != self._index_mtime:
+            self._index = LocalIndex(self.path)
+            self._index_mtime = mtime
+        return self._index
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def query(self, question: str, limit: int = 5, exact: bool = False) -> list[Hit]:
+        vector = self._embed([question])[0]
+        with self._lock, VECTOR_QUERY_SECONDS.labels("local").time():
+            index = self._current_index()
+            results = index.search(vector, limit, nprobe=self.nprobe, exact=exact)
+            return [
+                Hit(
+                    id=index.chunks[row]["id"],
+                    text=index.chunks[row]["text"],
+                    metadata=index.chunks[row].get("metadata") or {},
+                    score=score,
+                )
+                for row, score in results
+            ]
+
+    def insert_chunks(
+        self, objects: Iterable[tuple[str, dict]], batch_size: int | None = None, **kwargs
+    ) -> set[str]:
+        for batch in _batched(objects, batch_size or 64):
+            ids = [uuid for uuid, _ in batch]
+            chunks = [properties for _, properties in batch]
+            vectors = self._embed([chunk["text"] for chunk in chunks])
+            with self._lock:
+                self._index.upsert(ids, chunks, vectors, self.model_name)
+        self._save()
+        return set()
+
+    def query_embeddings(self) -> Embeddings:
+        return self.embeddings
+
+    def delete_chunks(self, uuids: list[str]):
+        with self._lock:
+            self._index.delete(uuids)
+        self._save()
+
+    def _save(self):
+        with self._lock:
+            self._index.save()
+            self._index_mtime = self._meta_mtime()
@@ -0,0 +1,42 @@
+"""Splitting of long answers into Discord messages."""
+
+import re
+
+# There is a 2000 character limit on Discord messages
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Boundaries to split on, from most to least preferred
+_BOUNDARIES = [
+    re.compile(r"\n\s*\n"),  # paragraphs
+    re.compile(r"\n"),  # lines
+    re.compile(r"(?<=[.!?])\s+"),  # sentences
+    re.compile(r"\s+"),  # words
+]
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """Split text into chunks of at most `limit` characters.
+
+    Each chunk is broken at the last paragraph boundary that fits, falling back to line,
+    sentence and then word boundaries, and only cutting mid-word if a single word is too long.
+    """
+    chunks = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[: limit + 1]
+        cut = None
+        for boundary in _BOUNDARIES:
+            # Ignore boundaries right at the start, which would leave a tiny chunk
+            matches = [m for m in boundary.finditer(window) if m.start() > limit // 4]
+            if matches:
+                cut = matches[-1]
+                break
+        if cut is None:
+            chunks.append(text[:limit])
+            text = text[limit:].lstrip()
+        else:
+            chunks.append(text[: cut.start()].rstrip())
+            text = text[cut.end() :]
+    if text:
+        chunks.append(text)
+    return chunks
@@ -0,0 +1,104 @@
+"""Prometheus metrics for the bot, served over HTTP for scraping.
+
+The time taken by the external services is measured separately from the end-to-end latency of
+`/ask`, so it's possible to tell whether the vector store, the model provider or Discord is the
+bottleneck:
+- `knowledge_bot_ask_seconds`: from the `/ask` command to the final answer being shown.
+- `knowledge_bot_vector_query_seconds`: each vector search, by backend.
+- `knowledge_bot_retrieval_seconds`: retrieving the context for an answer, including embedding
+  the question, searching and packing the results.
+- `knowledge_bot_llm_seconds`: generating an answer, or planning and executing a Portia run.
+- `knowledge_bot_discord_seconds`: sending and editing Discord messages.
+- `knowledge_bot_asks_total`: `/ask` commands by outcome, including failures.
+- `knowledge_bot_cache_hits_total` / `knowledge_bot_cache_misses_total`: by cache.
+- `knowledge_bot_queue_depth`: questions waiting for a worker.
+"""
+
+from collections.abc import Callable, Iterable, Iterator
+from typing import Protocol
+
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from bot.timing import record_stages
+
+# Answers take seconds, so the default buckets (which top out at 10s) are too fine-grained
+ANSWER_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120)
+LLM_STAGES = ("generation", "planning", "execution")
+
+ASK_SECONDS = Histogram(
+    "knowledge_bot_ask_seconds",
+    "Time from an /ask command to its answer being shown",
+    buckets=ANSWER_BUCKETS,
+)
+ASKS = Counter("knowledge_bot_asks", "/ask commands by outcome", ["outcome"])
+VECTOR_QUERY_SECONDS = Histogram(
+    "knowledge_bot_vector_query_seconds", "Time taken by vector searches", ["backend"]
+)
+RETRIEVAL_SECONDS = Histogram(
+    "knowledge_bot_retrieval_seconds",
+    "Time taken to retrieve and pack the context for an answer",
+)
+LLM_SECONDS = Histogram(
+    "knowledge_bot_llm_seconds",
+    "Time taken by LLM calls and Portia runs, by step",
+    ["step"],
+    buckets=ANSWER_BUCKETS,
+)
+DISCORD_SECONDS = Histogram(
+    "knowledge_bot_discord_seconds", "Time taken to send, edit or delete Discord messages", ["operation"]
+)
+
+
+class _Stats(Protocol):
+    def stats(self) -> dict[str, int]: ...
+
+
+class _BotCollector(Collector):
+    """Exposes the queue depth and cache statistics, read when the metrics are scraped."""
+
+    def __init__(self, queue_depth: Callable[[], int], caches: dict[str, _Stats]):
+        self.queue_depth = queue_depth
+        self.caches = caches
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "knowledge_bot_queue_depth",
+            "Questions waiting for a worker",
+            value=self.queue_depth(),
+        )
+        hits = CounterMetricFamily(
+            "knowledge_bot_cache_hits", "Cache hits by cache", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "knowledge_bot_cache_misses", "Cache misses by cache", labels=["cache"]
+        )
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+        yield hits
+        yield misses
+
+
+def start_metrics_server(port: int, queue_depth: Callable[[], int], caches: dict[str, _Stats]):
+    """Serve the metrics at http://<host>:<port>/metrics from a background thread."""
+    REGISTRY.register(_BotCollector(queue_depth, caches))
+    start_http_server(port)
+    print(f"Serving metrics on port {port}")
+
+
+def observe_stages(answer_fn: Callable[[str], Iterable[str]]) -> Callable[[str], Iterator[str]]:
+    """Wrap a streaming answer function to record the time spent in each stage of answering."""
+
+    def answer(question: str) -> Iterator[str]:
+        with record_stages() as timings:
+            yield from answer_fn(question)
+        if "retrieval" in timings:
+            RETRIEVAL_SECONDS.observe(timings["retrieval"])
+        for step in LLM_STAGES:
+            if step in timings:
+                LLM_SECONDS.labels(step).observe(timings[step])
+
+    return answer
@@ -0,0 +1,91 @@
+"""Packing of retrieved chunks into the context given to the LLM.
+
+Neighbouring chunks of the same page are often retrieved together, and chunks can overlap, so
+passing the chunks to the LLM as-is repeats text and splits passages up. Instead, chunks from
+the same page are merged where they overlap or are adjacent, and the merged passages are then
+fitted to a token budget, most relevant first.
+"""
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from bot.tokens import count_tokens, truncate_tokens
+
+if TYPE_CHECKING:
+    from bot.retrieval import Hit
+
+# Don't bother including a truncated passage if there's only room for a few tokens of it
+MIN_TRUNCATED_TOKENS = 50
+MAX_ADJACENT_GAP = 2
+
+
+@dataclass
+class Passage:
+    """A span of a page made up of one or more merged chunks."""
+
+    source: str
+    start: int | None
+    text: str
+    rank: int
+
+    @property
+    def end(self) -> int | None:
+        return None if self.start is None else self.start + len(self.text)
+
+    def to_dict(self) -> dict:
+        return {"source": self.source, "start_index": self.start, "text": self.text}
+
+
+def merge_chunks(hits: list["Hit"]) -> list[Passage]:
+    """Merge overlapping and adjacent chunks from the same source, in order of relevance."""
+    by_source: dict[str, list[Passage]] = {}
+    for rank, hit in enumerate(hits):
+        source = hit.metadata.get("source", "")
+        by_source.setdefault(source, []).append(
+            Passage(source, hit.metadata.get("start_index"), hit.text, rank)
+        )
+
+    passages = []
+    seen_texts = set()
+    for source, chunks in by_source.items():
+        # Chunks without a position can't be merged, so just drop exact duplicates
+        for chunk in (c for c in chunks if c.start is None):
+            if chunk.text not in seen_texts:
+                seen_texts.add(chunk.text)
+                passages.append(chunk)
+
+        merged: Passage | None = None
+        for chunk in sorted((c for c in chunks if c.start is not None), key=lambda c: c.start):
+            # Chunk text is stripped, so adjacent chunks can be separated by a little whitespace
+            if merged is not None and chunk.start <= merged.end + MAX_ADJACENT_GAP:
+                gap = chunk.start - merged.end
+                # Skip the overlapping text, or fill the gap so that offsets still line up
+                merged.text += "\n" * gap + chunk.text[max(-gap, 0) :]
+                merged.rank = min(merged.rank, chunk.rank)
+                continue
+            if merged is not None:
+                passages.append(merged)
+            merged = Passage(source, chunk.start, chunk.text, chunk.rank)
+        if merged is not None:
+            passages.append(merged)
+    return sorted(passages, key=lambda p: p.rank)
+
+
+def pack_context(hits: list["Hit"], token_budget: int) -> list[Passage]:
+    """Merge the chunks and keep the most relevant passages that fit in the token budget."""
+    packed = []
+    remaining = token_budget
+    for passage in merge_chunks(hits):
+        tokens = count_tokens(passage.text)
+        if tokens > remaining:
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                passage.text = truncate_tokens(passage.text, remaining)
+                packed.append(passage)
+            break
+        packed.append(passage)
+        remaining -= tokens
+    return packed
+
+
+def format_context(passages: list[Passage]) -> str:
+    return "\n\n".join(f"Source: {p.source}\n{p.text}" for p in passages)
@@ -0,0 +1,180 @@
+"""Retrieval of chunks of the Portia SDK docs.
+
+Retrieval goes through a `RetrievalBackend`, selected with the `RAG_BACKEND` env var:
+- `weaviate` (default): the `SDK_Docs` collection in Weaviate, see `weaviate.py`.
+- `local`: an in-process index with a local embedding model, see `local_index.py`. This needs
+  no Weaviate instance and no embedding API.
+"""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_core.prompts import ChatPromptTemplate
+from portia import ToolRunContext
+from portia.tool import Tool
+from pydantic import BaseModel, Field
+
+from bot.packing import Passage, pack_context
+
+load_dotenv(override=True)
+
+RESULTS_PER_QUERY = 5
+MAX_RESULTS = 10
+MAX_CONCURRENT_QUERIES = 8
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+
+RETRIEVAL_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "human",
+            """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
+            Question: {question},
+            Context: {context} ,
+            Answer:""",
+        ),
+    ],
+)
+
+
+@dataclass
+class Hit:
+    """A chunk returned by a retrieval backend."""
+
+    id: str
+    text: str
+    metadata: dict = field(default_factory=dict)
+    score: float = 0.0
+
+
+class RetrievalBackend(ABC):
+    """Stores chunks of the docs and retrieves the most relevant ones for a query."""
+
+    @abstractmethod
+    def query(self, question: str, limit: int = 5) -> list[Hit]:
+        """Return the `limit` chunks most relevant to the question."""
+
+    def query_many(self, questions: list[str], limit: int = 5) -> list[list[Hit]]:
+        """Run several queries concurrently, returning the hits for each."""
+        if not questions:
+            return []
+        if len(questions) == 1:
+            return [self.query(questions[0], limit=limit)]
+        workers = min(len(questions), MAX_CONCURRENT_QUERIES)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda q: self.query(q, limit=limit), questions))
+
+    @abstractmethod
+    def insert_chunks(self, objects: Iterable[tuple[str, dict]], **kwargs) -> set[str]:
+        """Insert (or overwrite) (UUID, properties) pairs, returning the IDs that failed."""
+
+    @abstractmethod
+    def delete_chunks(self, uuids: list[str]):
+        """Delete the chunks with the given IDs."""
+
+    @abstractmethod
+    def query_embeddings(self) -> Embeddings:
+        """The model that questions are embedded with, for the answer cache to use too."""
+
+    def close(self):
+        pass
+
+
+def reciprocal_rank_fusion(results: list[list[Hit]], limit: int, k: int = 60) -> list[Hit]:
+    """Merge ranked lists of hits into one, deduplicating chunks found by several queries.
+
+    Each chunk scores 1 / (k + rank) for every list it appears in, so chunks that rank highly
+    for several queries come out on top.
+    """
+    scores: dict[str, float] = {}
+    hits: dict[str, Hit] = {}
+    for ranked in results:
+        for rank, hit in enumerate(ranked, start=1):
+            scores[hit.id] = scores.get(hit.id, 0) + 1 / (k + rank)
+            hits.setdefault(hit.id, hit)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+    return [hits[id_] for id_ in best]
+
+
+_backend: RetrievalBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_retrieval_backend() -> RetrievalBackend:
+    """Return the shared retrieval backend configured by `RAG_BACKEND`."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            # Imported here so that only the selected backend's dependencies are loaded
+            name = os.getenv("RAG_BACKEND", "weaviate")
+            if name == "weaviate":
+                from bot.weaviate import WeaviateBackend
+
+                _backend = WeaviateBackend()
+            elif name == "local":
+                from bot.local_index import LocalBackend
+
+                _backend = LocalBackend()
+            else:
+                raise ValueError(f"Unknown RAG_BACKEND: {name}")
+        return _backend
+
+
+def close_retrieval_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        _backend = None
+
+
+class RAGQueryDBToolSchema(BaseModel):
+    """Input for RAGQueryTool."""
+
+    questions: list[str] = Field(
+        ...,
+        description=(
+            "The questions to search for in the given doc source. For questions with several "
+            "parts, pass a separate sub-question for each part to search for them all at once."
+        ),
+    )
+
+
+class RAGQueryDBTool(Tool[str]):
+    """Uses RAG to answer questions."""
+
+    id: str = "rag_query_tool"
+    name: str = "RAG Query Tool"
+    description: str = "Used to retrieve information from the Portia SDK docs."
+    args_schema: type[BaseModel] = RAGQueryDBToolSchema
+    output_schema: tuple[str, str] = (
+        "list",
+        "A list of passages relevant to the query, each with its source URL, its position in "
+        "the source and its text.",
+    )
+
+    def run(self, _: ToolRunContext, questions: list[str]) -> list[dict]:
+        """Run the RAG Query Tool."""
+
+        return [passage.to_dict() for passage in self.retrieve(questions)]
+
+    def retrieve(self, questions: list[str]) -> list[Passage]:
+        """Retrieve the chunks for the questions, packed into passages within the token budget."""
+        results = get_retrieval_backend().query_many(questions, limit=RESULTS_PER_QUERY)
+        hits = reciprocal_rank_fusion(
+            results, limit=min(RESULTS_PER_QUERY * len(questions), MAX_RESULTS)
+        )
+        return pack_context(hits, token_budget=CONTEXT_TOKEN_BUDGET)
+
+
+if __name__ == "__main__":
+    try:
+        # Can be used for local testing of the tool
+        print(RAGQueryDBTool().run(None, questions=["What is the Portia SDK?"]))  # type: ignore
+    finally:
+        close_retrieval_backend()
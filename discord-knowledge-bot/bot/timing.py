@@ -0,0 +1,51 @@
+"""Timing of the stages of answering a question.
+
+Stages are timed with `stage()`, and the timings are collected by whoever wraps the call in
+`record_stages()`, such as the load test. Timings are kept in a context variable, so concurrent
+questions on different worker threads are timed separately, and timing costs almost nothing
+when nothing is recording.
+"""
+
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TypeVar
+
+T = TypeVar("T")
+
+_stage_timings: ContextVar[dict[str, float] | None] = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def record_stages() -> Iterator[dict[str, float]]:
+    """Collect the total seconds spent in each stage within the block."""
+    timings: dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def timed_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Iterate, timing only the time spent producing items (not the time the consumer takes)."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
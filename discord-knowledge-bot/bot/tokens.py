@@ -0,0 +1,33 @@
+"""Token counting with the tokeniser used by the LLM."""
+
+from functools import cache
+
+import tiktoken
+
+# Rough size of a token in English text, used if the tokeniser can't be loaded
+CHARS_PER_TOKEN = 4
+
+
+@cache
+def _encoding() -> tiktoken.Encoding | None:
+    # Loaded on first use, as tiktoken downloads the encoding the first time it is used
+    try:
+        return tiktoken.get_encoding("o200k_base")  # The encoding used by gpt-4o
+    except OSError as e:
+        # e.g. when running offline without the encoding cached
+        print(f"Couldn't load the tokeniser, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = _encoding()
+    if encoding is None:
+        return text[: max_tokens * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
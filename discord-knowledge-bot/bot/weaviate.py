@@ -1,60 +1,204 @@
+import asyncio
 import os
+import threading
 import time
-
-from portia import ToolRunContext
+from collections.abc import Coroutine, Iterable
+from typing import Any, TypeVar
 
 import weaviate
 from dotenv import load_dotenv
 from langchain_core.documents import Document
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from markdownify import markdownify as md
-from portia.tool import Tool
-from pydantic import BaseModel, Field
+from langchain_core.embeddings import Embeddings
 from tqdm import tqdm
 from weaviate.classes.config import Configure, DataType, Property
 from weaviate.classes.init import Auth
+from weaviate.classes.query import Filter, MetadataQuery
+from weaviate.collections import Collection, CollectionAsync
+from weaviate.exceptions import WeaviateBaseError
+
+from bot.chunking import chunk_objects, split_document
+from bot.embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, get_query_embeddings
+from bot.metrics import VECTOR_QUERY_SECONDS
+from bot.retrieval import Hit, RetrievalBackend
 
 load_dotenv(override=True)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 VECTORISER_CONFIG = Configure.Vectorizer.text2vec_openai(
-    model="text-embedding-3-large",
-    dimensions=1024,  # Choose from 256, 1024, or 3072
-)
-RETRIEVAL_PROMPT = ChatPromptTemplate.from_messages(
-    [
-        (
-            "human",
-            """You are an assistant for question-answering tasks. Use the following pieces of retrieved context to answer the question. If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise.
-            Question: {question},
-            Context: {context} ,
-            Answer:""",
-        ),
-    ],
+    model=EMBEDDING_MODEL,
+    dimensions=EMBEDDING_DIMENSIONS,
 )
-if "localhost" in os.getenv("WEAVIATE_URL"):
-    WEAVIATE_CLIENT = weaviate.connect_to_local(
-        headers={"X-OpenAI-Api-Key": OPENAI_API_KEY},
+SDK_DOCS_COLLECTION_NAME = "SDK_Docs"
+QUANTIZERS = ("none", "pq", "bq", "sq")
+WEAVIATE_READY_TIMEOUT = float(os.getenv("WEAVIATE_READY_TIMEOUT", "60"))
+
+_weaviate_client: weaviate.WeaviateClient | None = None
+_docs_collection: Collection | None = None
+_weaviate_lock = threading.Lock()
+_async_client: weaviate.WeaviateAsyncClient | None = None
+_async_loop: asyncio.AbstractEventLoop | None = None
+# Guards connecting the async client, on the async loop
+_async_client_lock: asyncio.Lock | None = None
+
+T = TypeVar("T")
+
+
+def get_weaviate_client() -> weaviate.WeaviateClient:
+    """Return the shared Weaviate client, connecting on first use."""
+    global _weaviate_client
+    with _weaviate_lock:
+        if _weaviate_client is None:
+            _weaviate_client = _connect_to_weaviate(WEAVIATE_READY_TIMEOUT)
+        return _weaviate_client
+
+
+def get_docs_collection() -> Collection:
+    """Return the SDK docs collection, creating it on first use if it doesn't exist."""
+    global _docs_collection
+    client = get_weaviate_client()
+    with _weaviate_lock:
+        if _docs_collection is None:
+            collection = client.collections.get(SDK_DOCS_COLLECTION_NAME)
+            if not collection.exists():
+                _create_docs_collection(client)
+            _docs_collection = collection
+        return _docs_collection
+
+
+def _run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the event loop thread that owns the shared async Weaviate client.
+
+    Queries come from synchronous tool calls on several threads, so rather than each of them
+    connecting an async client to its own event loop, they share one long-lived loop.
+    """
+    global _async_loop, _async_client_lock
+    with _weaviate_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            _async_client_lock = asyncio.Lock()
+            threading.Thread(
+                target=_async_loop.run_forever, name="weaviate-async", daemon=True
+            ).start()
+    return asyncio.run_coroutine_threadsafe(coro, _async_loop).result()
+
+
+async def _get_async_docs_collection() -> CollectionAsync:
+    """Return the SDK docs collection from the shared async client (on the async loop)."""
+    global _async_client
+    # Concurrent first queries wait for one client to connect, rather than each connecting one
+    async with _async_client_lock:
+        if _async_client is None:
+            # Make sure Weaviate is ready and the collection exists before connecting. This
+            # blocks (it polls until Weaviate is ready), so it runs off the loop so as not to
+            # hold up other queries.
+            await asyncio.to_thread(get_docs_collection)
+            client = _create_weaviate_client(use_async=True)
+            await client.connect()
+            _async_client = client
+    return _async_client.collections.get(SDK_DOCS_COLLECTION_NAME)
+
+
+def _connect_to_weaviate(timeout: float) -> weaviate.WeaviateClient:
+    """Connect to Weaviate, retrying with exponential backoff until it is ready."""
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
+        try:
+            client = _create_weaviate_client()
+            if client.is_ready():
+                return client
+            client.close()
+            error = "not ready"
+        except WeaviateBaseError as e:
+            error = str(e)
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Weaviate was not ready after {timeout:.0f}s: {error}")
+        print(f"Waiting for Weaviate to be ready ({error}), retrying in {delay:.1f}s...")
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
+
+
+def _create_weaviate_client(use_async: bool = False):
+    headers = {"X-OpenAI-Api-Key": OPENAI_API_KEY}
+    if "localhost" in os.getenv("WEAVIATE_URL", ""):
+        if use_async:
+            return weaviate.use_async_with_local(headers=headers)
+        return weaviate.connect_to_local(headers=headers)
+    cluster_url = os.getenv("WEAVIATE_URL")
+    auth_credentials = Auth.api_key(os.getenv("WEAVIATE_API_KEY"))
+    if use_async:
+        return weaviate.use_async_with_weaviate_cloud(
+            cluster_url=cluster_url, auth_credentials=auth_credentials, headers=headers
+        )
+    return weaviate.connect_to_weaviate_cloud(
+        cluster_url=cluster_url, auth_credentials=auth_credentials, headers=headers
     )
-else:
-    WEAVIATE_CLIENT = weaviate.connect_to_weaviate_cloud(
-        cluster_url=os.getenv("WEAVIATE_URL"),
-        auth_credentials=Auth.api_key(os.getenv("WEAVIATE_API_KEY")),
-        headers={"X-OpenAI-Api-Key": OPENAI_API_KEY},
+
+
+def _optional_int(name: str) -> int | None:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def vector_index_config(
+    quantizer: str = "none",
+    ef: int | None = None,
+    max_connections: int | None = None,
+    ef_construction: int | None = None,
+    training_limit: int | None = None,
+):
+    """HNSW index config, optionally with vectors compressed by a quantizer.
+
+    - `pq`: product quantisation, trained on the first `training_limit` vectors.
+    - `bq`: binary quantisation, one bit per dimension.
+    - `sq`: scalar quantisation, one byte per dimension.
+
+    Compressed vectors are rescored against the full vectors on disk, so recall stays close to
+    uncompressed search while using a fraction of the memory. Unset HNSW parameters use
+    Weaviate's defaults.
+    """
+    if quantizer not in QUANTIZERS:
+        raise ValueError(f"Unknown quantizer {quantizer!r}, choose from {', '.join(QUANTIZERS)}")
+    quantizer_config = {
+        "none": None,
+        "pq": Configure.VectorIndex.Quantizer.pq(training_limit=training_limit),
+        "bq": Configure.VectorIndex.Quantizer.bq(),
+        "sq": Configure.VectorIndex.Quantizer.sq(training_limit=training_limit),
+    }[quantizer]
+    return Configure.VectorIndex.hnsw(
+        ef=ef,
+        max_connections=max_connections,
+        ef_construction=ef_construction,
+        quantizer=quantizer_config,
     )
 
-while not WEAVIATE_CLIENT.is_ready():
-    print("Waiting for Weaviate to be ready...")
-    time.sleep(1)
 
-SDK_DOCS_COLLECTION_NAME = "SDK_Docs"
-DOCS_COLLECTION = WEAVIATE_CLIENT.collections.get(SDK_DOCS_COLLECTION_NAME)
-if not DOCS_COLLECTION.exists():
-    print("Creating Weaviate collection...")
-    WEAVIATE_CLIENT.collections.create(
-        name=SDK_DOCS_COLLECTION_NAME,
-        vectorizer_config=VECTORISER_CONFIG,
+def _vector_index_config_from_env():
+    return vector_index_config(
+        quantizer=os.getenv("WEAVIATE_QUANTIZER", "none"),
+        ef=_optional_int("WEAVIATE_HNSW_EF"),
+        max_connections=_optional_int("WEAVIATE_HNSW_MAX_CONNECTIONS"),
+        ef_construction=_optional_int("WEAVIATE_HNSW_EF_CONSTRUCTION"),
+        training_limit=_optional_int("WEAVIATE_QUANTIZER_TRAINING_LIMIT"),
+    )
+
+
+def _create_docs_collection(
+    client: weaviate.WeaviateClient,
+    name: str = SDK_DOCS_COLLECTION_NAME,
+    vectorizer_config=VECTORISER_CONFIG,
+    index_config=None,
+):
+    """Create the docs collection. The vector index is configured from the env by default.
+
+    Note that only `ef` can be changed once the collection exists: to change the other settings,
+    delete the collection and reload the docs.
+    """
+    print(f"Creating Weaviate collection {name}...")
+    client.collections.create(
+        name=name,
+        vectorizer_config=vectorizer_config,
+        vector_index_config=index_config or _vector_index_config_from_env(),
         properties=[
             Property(name="text", data_type=DataType.TEXT),
             Property(
@@ -64,66 +208,170 @@ if not DOCS_COLLECTION.exists():
                     Property(name="name", data_type=DataType.TEXT),
                     Property(name="source", data_type=DataType.TEXT),
                     Property(name="content_type", data_type=DataType.TEXT),
+                    Property(name="title", data_type=DataType.TEXT),
+                    Property(name="chunk_index", data_type=DataType.INT),
+                    Property(name="start_index", data_type=DataType.INT),
+                    Property(name="heading_path", data_type=DataType.TEXT),
                 ],
             ),
         ],
     )
 
 
-def insert_docs_into_weaviate(documents: list[Document]):
-    """Insert documents into Weaviate."""
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+def insert_docs_into_weaviate(
+    documents: list[Document],
+    batch_size: int | None = None,
+    concurrent_requests: int = 2,
+    max_retries: int = 3,
+) -> tuple[dict[str, list[str]], set[str]]:
+    """Split documents into chunks and insert them into Weaviate.
+
+    Returns the chunk IDs inserted for each source, along with the IDs of any chunks that could
+    not be inserted.
+    """
+    chunk_ids: dict[str, list[str]] = {}
+    objects = []
     for doc in documents:
-        doc.page_content = md(doc.page_content)
-    all_splits = text_splitter.split_documents(documents)
-    for split in tqdm(all_splits, desc="Inserting documents", unit="chunk"):
-        DOCS_COLLECTION.data.insert(
-            {
-                "text": split.page_content,
-                "metadata": split.metadata,
-            }
+        page_objects = chunk_objects(doc.metadata["source"], split_document(doc))
+        chunk_ids[doc.metadata["source"]] = [uuid for uuid, _ in page_objects]
+        objects.extend(page_objects)
+    failed_ids = insert_chunks_into_weaviate(
+        objects,
+        batch_size=batch_size,
+        concurrent_requests=concurrent_requests,
+        max_retries=max_retries,
+    )
+    return chunk_ids, failed_ids
+
+
+def insert_chunks_into_weaviate(
+    objects: Iterable[tuple[str, dict]],
+    batch_size: int | None = None,
+    concurrent_requests: int = 2,
+    max_retries: int = 3,
+) -> set[str]:
+    """Insert (UUID, properties) pairs into Weaviate using the batch API.
+
+    `objects` may be a lazy iterator, in which case objects are sent as they are produced.
+    If `batch_size` is None, Weaviate's dynamic batching is used, which sizes batches based on
+    the load on the server. Objects that fail to insert are retried up to `max_retries` times.
+
+    Returns the IDs of any objects that could not be inserted.
+    """
+    docs_collection = get_docs_collection()
+    start = time.perf_counter()
+    inserted = _batch_insert(objects, batch_size, concurrent_requests)
+    for attempt in range(max_retries):
+        failed = docs_collection.batch.failed_objects
+        if not failed:
+            break
+        print(f"Retrying {len(failed)} failed objects (attempt {attempt + 1})...")
+        inserted -= len(failed)
+        inserted += _batch_insert(
+            [(str(error.object_.uuid), error.object_.properties) for error in failed],
+            batch_size,
+            concurrent_requests,
+        )
+    failed = docs_collection.batch.failed_objects
+    inserted -= len(failed)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Inserted {inserted} chunks in {elapsed:.1f}s "
+        f"({inserted / max(elapsed, 1e-9):.1f} objects/sec)"
+    )
+    if failed:
+        print(f"Failed to insert {len(failed)} chunks: {failed[0].message}")
+    return {str(error.object_.uuid) for error in failed}
+
+
+def _batch_insert(
+    objects: Iterable[tuple[str, dict]],
+    batch_size: int | None,
+    concurrent_requests: int,
+) -> int:
+    """Send (UUID, properties) pairs to Weaviate in batches, returning the number sent."""
+    docs_collection = get_docs_collection()
+    if batch_size is None:
+        batcher = docs_collection.batch.dynamic()
+    else:
+        batcher = docs_collection.batch.fixed_size(
+            batch_size=batch_size,
+            concurrent_requests=concurrent_requests,
         )
+    sent = 0
+    with batcher as batch:
+        for uuid, properties in tqdm(objects, desc="Inserting documents", unit="chunk"):
+            batch.add_object(properties=properties, uuid=uuid)
+            sent += 1
+    return sent
+
+
+def delete_chunks(uuids: list[str]):
+    """Delete chunks from Weaviate by ID."""
+    if uuids:
+        get_docs_collection().data.delete_many(where=Filter.by_id().contains_any(uuids))
 
 
 def close_weaviate():
-    WEAVIATE_CLIENT.close()
+    global _weaviate_client, _docs_collection, _async_client, _async_loop, _async_client_lock
+    if _async_client is not None:
+        _run_async(_async_client.close())
+        _async_client = None
+    with _weaviate_lock:
+        if _async_loop is not None:
+            _async_loop.call_soon_threadsafe(_async_loop.stop)
+        _async_loop = None
+        _async_client_lock = None
+        if _weaviate_client is not None:
+            _weaviate_client.close()
+        _weaviate_client = None
+        _docs_collection = None
 
 
-class RAGQueryDBToolSchema(BaseModel):
-    """Input for RAGQueryTool."""
+class WeaviateBackend(RetrievalBackend):
+    """Retrieval backend using the `SDK_Docs` collection in Weaviate."""
 
-    question: str = Field(
-        ...,
-        description=("The question to search for in the given doc source."),
-    )
+    def query(self, question: str, limit: int = 5) -> list[Hit]:
+        return self.query_many([question], limit=limit)[0]
 
+    def query_many(self, questions: list[str], limit: int = 5) -> list[list[Hit]]:
+        return _run_async(self._aquery_many(questions, limit))
 
-class RAGQueryDBTool(Tool[str]):
-    """Uses RAG to answer questions."""
+    async def _aquery_many(self, questions: list[str], limit: int) -> list[list[Hit]]:
+        collection = await _get_async_docs_collection()
 
-    id: str = "rag_query_tool"
-    name: str = "RAG Query Tool"
-    description: str = "Used to retrieve information from the Portia SDK docs."
-    args_schema: type[BaseModel] = RAGQueryDBToolSchema
-    output_schema: tuple[str, str] = (
-        "list",
-        "A list of results relevant to the query.",
-    )
+        async def aquery(question: str) -> list[Hit]:
+            # Embedding the query ourselves (rather than using near_text) lets us cache the
+            # embedding, saving a round trip to the embedding API for repeated queries
+            vector = await asyncio.to_thread(get_query_embeddings().embed_query, question)
+            start = time.perf_counter()
+            result = await collection.query.near_vector(
+                near_vector=vector,
+                limit=limit,
+                return_properties=["text", "metadata"],
+                return_metadata=MetadataQuery(distance=True),
+            )
+            VECTOR_QUERY_SECONDS.labels("weaviate").observe(time.perf_counter() - start)
+            return [
+                Hit(
+                    id=str(obj.uuid),
+                    text=obj.properties["text"],
+                    metadata=obj.properties.get("metadata") or {},
+                    score=1 - (obj.metadata.distance or 0),
+                )
+                for obj in result.objects
+            ]
 
-    def run(self, _: ToolRunContext, question: str) -> str:
-        """Run the RAG Query Tool."""
+        return await asyncio.gather(*(aquery(question) for question in questions))
 
-        result = DOCS_COLLECTION.query.near_text(
-            query=question,
-            limit=5,
-            return_properties=["text"],
-        )
-        return [obj.properties["text"] for obj in result.objects]
+    def insert_chunks(self, objects: Iterable[tuple[str, dict]], **kwargs) -> set[str]:
+        return insert_chunks_into_weaviate(objects, **kwargs)
+
+    def delete_chunks(self, uuids: list[str]):
+        delete_chunks(uuids)
 
+    def query_embeddings(self) -> Embeddings:
+        return get_query_embeddings()
 
-if __name__ == "__main__":
-    try:
-        # Can be used for local testing of the tool
-        print(RAGQueryDBTool().run(None, question="What is the Portia SDK?"))  # type: ignore
-    finally:
+    def close(self):
         close_weaviate()
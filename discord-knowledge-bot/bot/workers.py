@@ -0,0 +1,152 @@
+"""Worker pool for answering questions off the Discord event loop.
+
+Agent runs are slow and synchronous, so they are run on a pool of worker threads. Answers are
+streamed back to the event loop as they are generated. Questions
+wait in a bounded queue for a free worker, and identical questions that are already queued or
+running share a single run. Users and channels are rate limited before anything is queued.
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from bot.cache import normalise_question
+
+
+class QueueFullError(Exception):
+    """Raised when there are too many questions waiting to be answered."""
+
+
+class RateLimitedError(Exception):
+    """Raised when a user or channel has asked too many questions recently."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Sliding window rate limiter allowing `limit` events per `window` seconds per key."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._events: dict[str, deque[float]] = defaultdict(deque)
+
+    def check(self, key: str):
+        """Record an event for `key`, raising RateLimitedError if it is over the limit."""
+        now = time.monotonic()
+        events = self._events[key]
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if len(events) >= self.limit:
+            raise RateLimitedError(events[0] + self.window - now)
+        events.append(now)
+
+
+@dataclass(eq=False)
+class Job:
+    key: str
+    question: str
+    future: asyncio.Future = field(repr=False)
+    # The answer generated so far, and an event that is set whenever it changes
+    text: str = ""
+    updated: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def _update(self, text: str):
+        self.text = text
+        self.updated.set()
+
+
+class AskQueue:
+    """Runs `answer_fn` for submitted questions on a pool of worker threads.
+
+    `answer_fn` should yield the answer in pieces as it is generated (and yield nothing if
+    there is no answer). Each job's future resolves to the full answer, or None.
+    """
+
+    def __init__(
+        self,
+        answer_fn: Callable[[str], Iterable[str]],
+        workers: int = 4,
+        max_pending: int = 32,
+        user_limiter: RateLimiter | None = None,
+        channel_limiter: RateLimiter | None = None,
+    ):
+        self.answer_fn = answer_fn
+        self.workers = workers
+        self.max_pending = max_pending
+        self.user_limiter = user_limiter or RateLimiter(limit=3, window=60)
+        self.channel_limiter = channel_limiter or RateLimiter(limit=20, window=60)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask")
+        self._queue: asyncio.Queue[Job] | None = None
+        self._waiting: deque[Job] = deque()
+        self._in_flight: dict[str, Job] = {}
+        self._worker_tasks: list[asyncio.Task] = []
+        self._idle_workers = 0
+
+    def submit(self, question: str, user_id: str, channel_id: str) -> Job:
+        """Queue a question, or join an identical question that is already in flight."""
+        self._start()
+        key = normalise_question(question)
+        job = self._in_flight.get(key)
+        self.user_limiter.check(str(user_id))
+        if job is not None:
+            return job
+        if len(self._waiting) >= self.max_pending:
+            raise QueueFullError()
+        self.channel_limiter.check(str(channel_id))
+
+        job = Job(key, question, asyncio.get_running_loop().create_future())
+        self._in_flight[key] = job
+        self._waiting.append(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def position(self, job: Job) -> int:
+        """The job's position in the queue (1 is next up), or 0 once it is running."""
+        try:
+            index = self._waiting.index(job)
+        except ValueError:
+            return 0
+        # Jobs that an idle worker is about to pick up aren't really waiting
+        return max(index + 1 - self._idle_workers, 0)
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiting)
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker_tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._idle_workers += 1
+            job = await self._queue.get()
+            self._idle_workers -= 1
+            self._waiting.remove(job)
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, self._answer, loop, job
+                )
+                job.future.set_result(result or None)
+            except Exception as e:
+                job.future.set_exception(e)
+            finally:
+                del self._in_flight[job.key]
+
+    def _answer(self, loop: asyncio.AbstractEventLoop, job: Job) -> str:
+        """Run in a worker thread, passing the answer so far back to the event loop."""
+        text = ""
+        for delta in self.answer_fn(job.question):
+            text += delta
+            loop.call_soon_threadsafe(job._update, text)
+        return text
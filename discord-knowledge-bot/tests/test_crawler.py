@@ -0,0 +1,175 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import httpx
+
+# Add the parent directory to the path to import the bot package
+sys.path.append(str(Path(__file__).parent.parent))
+
+from bot.crawler import Crawler, ResponseCache
+
+ROOT = "https://docs.test/"
+
+
+class FakeSite:
+    """Serves `pages` (by URL) through an `httpx.MockTransport`, recording the requests made."""
+
+    def __init__(self, pages: dict[str, str], delay: float = 0):
+        self.pages = pages
+        self.status: dict[str, int] = {}
+        self.delay = delay
+        self.requested: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        self.requested.append(url)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if url in self.status:
+            return httpx.Response(self.status[url])
+        if url not in self.pages:
+            return httpx.Response(404)
+        etag = f'"{hash(self.pages[url])}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304)
+        content_type = "application/xml" if url.endswith(".xml") else "text/html"
+        return httpx.Response(
+            200,
+            headers={"content-type": content_type, "etag": etag},
+            text=self.pages[url],
+        )
+
+
+def page(text: str, links: list[str] = ()) -> str:
+    anchors = " ".join(f'<a href="{link}">{link}</a>' for link in links)
+    return f"<html><head><title>{text}</title></head><body>{anchors}<p>{text}</p></body></html>"
+
+
+def sitemap(urls: list[str]) -> str:
+    locs = "".join(f"<url><loc>{url}</loc></url>" for url in urls)
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>'
+
+
+class TestCrawler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = ResponseCache(tmp.name)
+
+    async def crawl(self, site: FakeSite, **kwargs) -> tuple[Crawler, dict[str, str]]:
+        """Crawl the site, returning the crawler and the content of each page by URL."""
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(site.handle), follow_redirects=True
+        ) as client:
+            crawler = Crawler(cache=self.cache, client=client, **kwargs)
+            docs = await crawler.crawl([ROOT])
+        return crawler, {doc.metadata["source"]: doc.page_content for doc in docs}
+
+    async def test_sitemap_seeding(self):
+        """Test that pages listed in the sitemap are crawled, even if nothing links to them"""
+        site = FakeSite({
+            ROOT: page("Home"),
+            ROOT + "sitemap.xml": sitemap(
+                [ROOT + "a", ROOT + "b", "https://elsewhere.test/c"]
+            ),
+            ROOT + "a": page("A"),
+            ROOT + "b": page("B"),
+        })
+        _, pages = await self.crawl(site)
+
+        self.assertEqual(set(pages), {ROOT, ROOT + "a", ROOT + "b"})
+        self.assertNotIn("https://elsewhere.test/c", site.requested)
+
+    async def test_stays_within_site(self):
+        """Test that links to other sites aren't followed"""
+        site = FakeSite({
+            ROOT: page("Home", ["/a", "https://elsewhere.test/b", "https://docs.test.evil/c"]),
+            ROOT + "a": page("A"),
+        })
+        _, pages = await self.crawl(site, use_sitemap=False)
+
+        self.assertEqual(set(pages), {ROOT, ROOT + "a"})
+        self.assertEqual(set(site.requested), {ROOT, ROOT + "a"})
+
+    async def test_depth_limit(self):
+        """Test that links are only followed to `max_depth`"""
+        site = FakeSite({
+            ROOT: page("Home", ["/1"]),
+            ROOT + "1": page("One", ["/2"]),
+            ROOT + "2": page("Two", ["/3"]),
+            ROOT + "3": page("Three"),
+        })
+        _, pages = await self.crawl(site, max_depth=2, use_sitemap=False)
+        self.assertEqual(set(pages), {ROOT, ROOT + "1"})
+
+        _, pages = await self.crawl(site, max_depth=3, use_sitemap=False)
+        self.assertEqual(set(pages), {ROOT, ROOT + "1", ROOT + "2"})
+
+    async def test_per_host_limit(self):
+        """Test that no more than `per_host_limit` requests are in flight to a host at once"""
+        links = [f"/{i}" for i in range(20)]
+        site = FakeSite(
+            {ROOT: page("Home", links), **{ROOT + link[1:]: page(link) for link in links}},
+            delay=0.01,
+        )
+        _, pages = await self.crawl(site, per_host_limit=3, use_sitemap=False)
+
+        self.assertEqual(len(pages), 21)
+        self.assertEqual(site.max_in_flight, 3)
+
+    async def test_not_modified_serves_cache(self):
+        """Test that a 304 response serves the cached page"""
+        site = FakeSite({ROOT: page("Home")})
+        await self.crawl(site, use_sitemap=False)
+        crawler, pages = await self.crawl(site, use_sitemap=False)
+
+        self.assertEqual(pages, {ROOT: page("Home")})
+        self.assertEqual(crawler.stats["not_modified"], 1)
+        self.assertEqual(crawler.stats["fetched"], 0)
+
+    async def test_server_error_falls_back_to_cache(self):
+        """Test that a page failing with a 5xx is served from the cache, and counted as an error"""
+        site = FakeSite({ROOT: page("Home", ["/a"]), ROOT + "a": page("A")})
+        await self.crawl(site, use_sitemap=False)
+        site.status[ROOT + "a"] = 503
+        crawler, pages = await self.crawl(site, use_sitemap=False)
+
+        self.assertEqual(pages[ROOT + "a"], page("A"))
+        self.assertEqual(crawler.stats["errors"], 1)
+        self.assertEqual(crawler.gone, set())
+
+    async def test_gone_pages_recorded(self):
+        """Test that pages returning 404 or 410 are recorded as gone, and not emitted"""
+        site = FakeSite({
+            ROOT: page("Home", ["/a", "/missing", "/removed"]),
+            ROOT + "a": page("A"),
+        })
+        site.status[ROOT + "removed"] = 410
+        crawler, pages = await self.crawl(site, use_sitemap=False)
+
+        self.assertEqual(set(pages), {ROOT, ROOT + "a"})
+        self.assertEqual(crawler.gone, {ROOT + "missing", ROOT + "removed"})
+        self.assertEqual(crawler.stats["errors"], 0)
+
+    async def test_check_gone(self):
+        """Test that pages can be checked directly for whether they're gone"""
+        site = FakeSite({ROOT + "a": page("A")})
+        site.status[ROOT + "b"] = 410
+        async with httpx.AsyncClient(transport=httpx.MockTransport(site.handle)) as client:
+            crawler = Crawler(cache=self.cache, client=client)
+            gone = await crawler.check_gone([ROOT + "a", ROOT + "b", ROOT + "c"])
+
+        self.assertEqual(gone, {ROOT + "b", ROOT + "c"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the path to import the bot package
+sys.path.append(str(Path(__file__).parent.parent))
+
+from bot import loader
+
+
+class DocsSite(http.server.ThreadingHTTPServer):
+    """A local docs site, serving the pages in `pages` (and 404 for anything else)."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), DocsHandler)
+        self.pages: dict[str, str] = {}
+        self.status = 200
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class DocsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.pages.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+        elif self.server.status != 200 and self.path != "/":
+            self.send_response(self.server.status)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBackend:
+    """Stands in for the retrieval backend, keeping the inserted chunks by ID."""
+
+    def __init__(self):
+        self.chunks: dict[str, dict] = {}
+
+    def insert_chunks(self, objects, batch_size=None, concurrent_requests=2):
+        for uuid, properties in objects:
+            self.chunks[uuid] = properties
+        return set()
+
+    def delete_chunks(self, ids):
+        for uuid in ids:
+            self.chunks.pop(uuid, None)
+
+    def sources(self) -> set[str]:
+        return {properties["metadata"]["source"] for properties in self.chunks.values()}
+
+
+def page(title: str, text: str, links: list[str] = ()) -> str:
+    anchors = " ".join(f'<a href="{link}">{link}</a>' for link in links)
+    return f"<html><head><title>{title}</title></head><body>{anchors}<p>{text}</p></body></html>"
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        # The manifest and HTTP cache are kept relative to the working directory
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        os.chdir(tmp.name)
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+
+        self.site = DocsSite()
+        threading.Thread(target=self.site.serve_forever, daemon=True).start()
+        self.addCleanup(self.site.server_close)
+        self.addCleanup(self.site.shutdown)
+        self.site.pages = {
+            "/": page("Home", "Welcome to the docs.", ["/a", "/b"]),
+            "/a": page("A", "Alpha covers planning and tools. " * 20),
+            "/b": page("B", "Bravo covers clarifications and hooks. " * 20),
+        }
+
+        self.backend = FakeBackend()
+        for name, value in (
+            ("get_retrieval_backend", lambda: self.backend),
+            ("bump_index_version", lambda: None),
+        ):
+            patcher = mock.patch.object(loader, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def load(self, **kwargs):
+        loader.load_docs([self.site.url], workers=1, **kwargs)
+
+    def test_deleted_unlinked_page_is_removed(self):
+        """Test that a page deleted from the site, and no longer linked to, is removed"""
+        self.load()
+        self.assertIn(self.site.url + "/b", self.backend.sources())
+
+        self.site.pages["/"] = page("Home", "Welcome to the docs.", ["/a"])
+        del self.site.pages["/b"]
+        self.load(incremental=True)
+
+        self.assertEqual(self.backend.sources(), {self.site.url + "/", self.site.url + "/a"})
+        self.assertNotIn(self.site.url + "/b", loader.load_manifest())
+
+    def test_unreached_page_is_kept_during_outage(self):
+        """Test that pages are kept if they can't be fetched, rather than treated as deleted"""
+        self.load()
+        self.site.status = 503
+        self.load(incremental=True)
+
+        self.assertEqual(
+            self.backend.sources(),
+            {self.site.url + "/", self.site.url + "/a", self.site.url + "/b"},
+        )
+
+    def test_duplicate_reloaded_when_original_removed(self):
+        """Test that a page dropped as a near-duplicate is reloaded when the page it copies goes"""
+        self.site.pages["/"] = page("Home", "Welcome to the docs.", ["/a", "/a-copy", "/b"])
+        self.site.pages["/a-copy"] = self.site.pages["/a"]
+        self.load()
+        manifest = loader.load_manifest()
+        duplicate = next(source for source in manifest if "duplicate_of" in manifest[source])
+        original = manifest[duplicate]["duplicate_of"]
+        self.assertNotIn(duplicate, self.backend.sources())
+
+        path = original.removeprefix(self.site.url)
+        del self.site.pages[path]
+        self.site.pages["/"] = page("Home", "Welcome to the docs.", ["/a", "/a-copy", "/b"])
+        self.load(incremental=True)
+
+        self.assertIn(duplicate, self.backend.sources())
+        self.assertNotIn(original, self.backend.sources())
+        self.assertNotIn("duplicate_of", loader.load_manifest()[duplicate])
+
+    def test_repeated_chunk_reloaded_when_owner_changes(self):
+        """Test that a chunk dropped as a repeat is reloaded when the page that kept it changes"""
+        shared = section("Installation", "Install the SDK with pip and then set your API keys. ")
+        self.site.pages["/"] = page("Home", "Welcome to the docs.", ["/c", "/d"])
+        self.site.pages["/c"] = page("C", section("Planning", "Plans are made of steps. ") + shared)
+        self.site.pages["/d"] = page("D", section("Hooks", "Hooks run before each tool. ") + shared)
+        self.load()
+        manifest = loader.load_manifest()
+        dependent = next(source for source in manifest if "repeated_from" in manifest[source])
+        owner = set(manifest[dependent]["repeated_from"].values()).pop()
+        self.assertEqual(len(self.chunks_containing("Install the SDK")), 1)
+
+        self.site.pages[owner.removeprefix(self.site.url)] = page(
+            "Owner", section("Planning", "Plans are made of steps and tools. ")
+        )
+        self.load(incremental=True)
+
+        self.assertEqual(
+            {chunk["metadata"]["source"] for chunk in self.chunks_containing("Install the SDK")},
+            {dependent},
+        )
+
+    def chunks_containing(self, text: str) -> list[dict]:
+        return [chunk for chunk in self.backend.chunks.values() if text in chunk["text"]]
+
+
+def section(heading: str, sentence: str) -> str:
+    return f"<h2>{heading}</h2><p>{sentence * 30}</p>"
+
+
+if __name__ == '__main__':
+    unittest.main()
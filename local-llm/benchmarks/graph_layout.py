@@ -0,0 +1,90 @@
+"""
+Benchmark of the concept map layouts.
+
+Compares the time and peak memory of the layout the visualization tool used to use for every
+concept map (networkx's spring layout, or its circular layout for up to 10 nodes) with the
+multilevel force-directed layout, on scale-free graphs like those of Obsidian vaults.
+
+Run from the local-llm directory with:
+
+    uv run python -m benchmarks.graph_layout [--sizes 100 1000 10000] [--spring-max-nodes 3000]
+
+networkx's spring layout takes minutes for the largest graphs, so it's skipped above
+--spring-max-nodes. For graphs of 500 nodes or more, networkx also needs scipy for it.
+"""
+
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from tools.graph_layout import circular_layout, force_directed_layout, spring_layout
+
+
+def previous_layout(G: nx.Graph, seed: int = 42, scale: float = 2.0) -> Dict:
+    """The layout the visualization tool picked before the layout engines were added."""
+    if len(G) <= 10:
+        return circular_layout(G, seed, scale)
+    return spring_layout(G, seed, scale)
+
+
+def measure(layout: Callable, G: nx.Graph) -> Tuple[float, float, Dict]:
+    """Time a layout, returning the seconds taken, peak memory in MB and the positions."""
+    start = time.perf_counter()
+    pos = layout(G)
+    elapsed = time.perf_counter() - start
+    # Tracing allocations slows everything down, so memory is measured on a second run
+    tracemalloc.start()
+    layout(G)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6, pos
+
+
+def edge_length_ratio(G: nx.Graph, pos: Dict, samples: int = 20000) -> float:
+    """Mean edge length over mean distance between random nodes. Lower is a tighter layout."""
+    nodes = list(G)
+    points = np.array([pos[node] for node in nodes])
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges])
+    edge_length = np.linalg.norm(points[edges[:, 0]] - points[edges[:, 1]], axis=1).mean()
+    pairs = np.random.default_rng(0).integers(0, len(nodes), size=(samples, 2))
+    return edge_length / np.linalg.norm(points[pairs[:, 0]] - points[pairs[:, 1]], axis=1).mean()
+
+
+def run(size: int, spring_max_nodes: int):
+    G = nx.barabasi_albert_graph(size, 2, seed=42)
+    layouts: Dict[str, Optional[Callable]] = {
+        "previous": previous_layout if size <= spring_max_nodes else None,
+        "force_directed": force_directed_layout,
+    }
+    for name, layout in layouts.items():
+        if layout is None:
+            print(f"{size:>7} {name:<15} {'skipped':>9}")
+            continue
+        try:
+            elapsed, peak, pos = measure(layout, G)
+        except ImportError as e:
+            print(f"{size:>7} {name:<15} {'skipped':>9}  ({e})")
+            continue
+        print(f"{size:>7} {name:<15} {elapsed:>8.2f}s {peak:>9.1f}MB {edge_length_ratio(G, pos):>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the concept map layouts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Numbers of nodes of the graphs to lay out")
+    parser.add_argument("--spring-max-nodes", type=int, default=3000,
+                        help="Skip networkx's spring layout for graphs larger than this")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>7} {'layout':<15} {'time':>9} {'peak mem':>11} {'edge/random':>12}")
+    for size in args.sizes:
+        run(size, args.spring_max_nodes)
+
+
+if __name__ == "__main__":
+    main()
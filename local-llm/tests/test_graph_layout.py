@@ -0,0 +1,64 @@
+import sys
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path to import the layout module
+sys.path.append(str(Path(__file__).parent.parent))
+
+try:
+    import networkx as nx
+    import numpy as np
+    from tools.graph_layout import compute_layout, choose_layout, force_directed_layout
+    LAYOUT_AVAILABLE = True
+except ImportError:
+    LAYOUT_AVAILABLE = False
+
+class TestGraphLayout(unittest.TestCase):
+    def setUp(self):
+        # Skip all tests if networkx or numpy is not available
+        if not LAYOUT_AVAILABLE:
+            self.skipTest("networkx or numpy not available")
+
+    def test_choose_layout_by_size(self):
+        """Test that the layout engine is picked by graph size"""
+        self.assertEqual(choose_layout(nx.path_graph(5)), "circular")
+        self.assertEqual(choose_layout(nx.path_graph(50)), "spring")
+        self.assertEqual(choose_layout(nx.path_graph(5000)), "force_directed")
+
+    def test_force_directed_layout(self):
+        """Test that every node gets a position within the scale"""
+        G = nx.barabasi_albert_graph(2000, 2, seed=1)
+        pos = force_directed_layout(G, seed=42, scale=2.0)
+
+        self.assertEqual(set(pos), set(G.nodes))
+        points = np.array(list(pos.values()))
+        self.assertTrue(np.isfinite(points).all())
+        self.assertLessEqual(np.abs(points).max(), 2.0 + 1e-9)
+        # Connected nodes should be placed closer together than nodes picked at random
+        edge_length = np.mean([np.linalg.norm(pos[u] - pos[v]) for u, v in G.edges])
+        random_distance = np.linalg.norm(points - points[::-1], axis=1).mean()
+        self.assertLess(edge_length, 0.6 * random_distance)
+
+    def test_force_directed_layout_is_deterministic(self):
+        """Test that the same seed gives the same layout"""
+        G = nx.DiGraph([("a", "b"), ("b", "c"), ("c", "a"), ("c", "d"), ("e", "f")] +
+                       [(f"n{i}", f"n{i + 1}") for i in range(400)])
+        first = compute_layout(G, "force_directed", seed=7)
+        second = compute_layout(G, "force_directed", seed=7)
+        for node in G.nodes:
+            np.testing.assert_array_equal(first[node], second[node])
+
+    def test_small_graphs(self):
+        """Test that graphs too small to coarsen are still laid out"""
+        for G in (nx.empty_graph(1), nx.path_graph(2), nx.path_graph(3)):
+            pos = compute_layout(G, "force_directed")
+            self.assertEqual(set(pos), set(G.nodes))
+            self.assertTrue(np.isfinite(np.array(list(pos.values()))).all())
+
+    def test_unknown_layout(self):
+        """Test that an unknown layout engine is rejected"""
+        with self.assertRaises(ValueError):
+            compute_layout(nx.path_graph(3), "hierarchical")
+
+if __name__ == '__main__':
+    unittest.main()
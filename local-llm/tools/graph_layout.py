@@ -0,0 +1,280 @@
+"""
+Layout engines for concept map visualizations.
+
+This module provides the layouts used to position the nodes of a concept map. Small maps
+use networkx's circular and spring layouts, but networkx's spring layout slows down
+quadratically with the number of nodes, which is too slow for maps of whole Obsidian
+vaults. For those, there's a multilevel force-directed layout written with vectorised
+NumPy operations:
+- The graph is repeatedly coarsened by merging connected nodes, until it's small.
+- The coarsest graph is laid out with Fruchterman-Reingold forces, and each finer graph
+  starts from the layout of the coarser one, so only needs a few iterations to refine it.
+- In large graphs, the repulsion between nodes is approximated Barnes-Hut style: nodes are
+  binned into a quadtree, and distant cells repel as a single mass at their centre.
+
+Layouts are registered in LAYOUT_ENGINES by name, and "auto" picks one by graph size.
+"""
+
+from typing import Callable, Dict, Hashable, List, Tuple
+
+import networkx as nx
+import numpy as np
+
+# Graph sizes (in nodes) up to which each layout is picked by "auto"
+CIRCULAR_MAX_NODES = 10
+SPRING_MAX_NODES = 200
+# Above this many nodes, repulsion is approximated rather than computed between every pair
+EXACT_REPULSION_MAX_NODES = 300
+# Coarsening stops once a graph has this many nodes, or stops getting much smaller
+COARSEST_NODES = 50
+COARSEST_ITERATIONS = 150
+REFINE_ITERATIONS = 40
+# Average nodes per cell of the finest grid when approximating repulsion
+NODES_PER_CELL = 8
+# Offsets (from the first child of the parent's cell) of the children of the parent's neighbours
+CHILD_OFFSETS = np.array([(dx, dy) for dx in range(-2, 4) for dy in range(-2, 4)])
+
+Layout = Dict[Hashable, np.ndarray]
+
+
+def circular_layout(G: nx.Graph, seed: int = 42, scale: float = 2.0) -> Layout:
+    """Place the nodes evenly around a circle."""
+    return nx.circular_layout(G, scale=scale)
+
+
+def spring_layout(G: nx.Graph, seed: int = 42, scale: float = 2.0) -> Layout:
+    """networkx's Fruchterman-Reingold layout, which is exact but slow for large graphs."""
+    return nx.spring_layout(G, k=2.0, iterations=100, seed=seed, scale=scale)
+
+
+def force_directed_layout(G: nx.Graph, seed: int = 42, scale: float = 2.0) -> Layout:
+    """
+    Multilevel force-directed layout, for graphs of thousands of nodes.
+
+    Args:
+        G: The graph to lay out
+        seed: Seed for the random initial positions and coarsening
+        scale: The positions are scaled to fit in [-scale, scale]
+
+    Returns:
+        Dictionary of node to position
+    """
+    nodes = list(G.nodes)
+    if len(nodes) <= 2:
+        return circular_layout(G, seed, scale)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array(
+        sorted({tuple(sorted((index[u], index[v]))) for u, v in G.edges if u != v}),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+
+    # Coarsen the graph, keeping the mapping from each level's nodes to the next level's
+    levels: List[Tuple[int, np.ndarray]] = [(len(nodes), edges)]
+    mappings: List[np.ndarray] = []
+    while levels[-1][0] > COARSEST_NODES:
+        n, level_edges = levels[-1]
+        mapping, coarse_n = _match_nodes(n, level_edges, rng)
+        if coarse_n > 0.9 * n:
+            break
+        coarse_edges = np.unique(np.sort(mapping[level_edges], axis=1), axis=0)
+        coarse_edges = coarse_edges[coarse_edges[:, 0] != coarse_edges[:, 1]]
+        mappings.append(mapping)
+        levels.append((coarse_n, coarse_edges))
+
+    # Lay out the coarsest graph from scratch, then refine the layout at each finer level
+    n, level_edges = levels[-1]
+    pos = _fruchterman_reingold(
+        rng.random((n, 2)), level_edges, COARSEST_ITERATIONS, temperature=0.1
+    )
+    for (n, level_edges), mapping in zip(reversed(levels[:-1]), reversed(mappings)):
+        # Merged nodes start in the same place, so nudge them apart
+        pos = pos[mapping] + rng.normal(scale=0.1 / np.sqrt(n), size=(n, 2))
+        pos = _fruchterman_reingold(pos, level_edges, REFINE_ITERATIONS, temperature=0.02)
+
+    pos = _rescale(pos, scale)
+    return {node: pos[i] for i, node in enumerate(nodes)}
+
+
+LAYOUT_ENGINES: Dict[str, Callable[[nx.Graph, int, float], Layout]] = {
+    "circular": circular_layout,
+    "spring": spring_layout,
+    "force_directed": force_directed_layout,
+}
+
+
+def choose_layout(G: nx.Graph) -> str:
+    """Pick the layout engine for a graph, based on its size."""
+    if len(G) <= CIRCULAR_MAX_NODES:
+        return "circular"
+    if len(G) <= SPRING_MAX_NODES:
+        return "spring"
+    return "force_directed"
+
+
+def compute_layout(G: nx.Graph, engine: str = "auto", seed: int = 42, scale: float = 2.0) -> Layout:
+    """
+    Compute the positions of the nodes of a graph.
+
+    Args:
+        G: The graph to lay out
+        engine: The name of a layout in LAYOUT_ENGINES, or "auto" to pick one by graph size
+        seed: Seed for layouts with random initial positions
+        scale: The positions are scaled to fit in [-scale, scale]
+
+    Returns:
+        Dictionary of node to position
+    """
+    if engine == "auto":
+        engine = choose_layout(G)
+    if engine not in LAYOUT_ENGINES:
+        raise ValueError(f"Unknown layout '{engine}'. Choose from: auto, {', '.join(LAYOUT_ENGINES)}")
+    return LAYOUT_ENGINES[engine](G, seed, scale)
+
+
+def _match_nodes(n: int, edges: np.ndarray, rng: np.random.Generator) -> Tuple[np.ndarray, int]:
+    """Merge groups of connected nodes, returning each node's index in the coarser graph."""
+    matched = np.full(n, -1, dtype=np.int64)
+    for u, v in edges[rng.permutation(len(edges))].tolist():
+        if matched[u] < 0 and matched[v] < 0:
+            matched[u] = v
+            matched[v] = u
+    representative = np.where(matched < 0, np.arange(n), np.minimum(np.arange(n), matched))
+    # The matching is maximal, so the neighbours of the unmatched nodes are all matched. The
+    # unmatched nodes join one of their neighbours' pairs, so that the leaves around a hub
+    # (which can't all be matched with it) are merged into it.
+    neighbour = np.full(n, -1, dtype=np.int64)
+    neighbour[edges[:, 0]] = edges[:, 1]
+    neighbour[edges[:, 1]] = edges[:, 0]
+    joining = (matched < 0) & (neighbour >= 0)
+    representative[joining] = representative[neighbour[joining]]
+    # Each group becomes a node of the coarser graph
+    _, mapping = np.unique(representative, return_inverse=True)
+    return mapping, int(mapping.max()) + 1
+
+
+def _fruchterman_reingold(pos: np.ndarray, edges: np.ndarray, iterations: int,
+                          temperature: float) -> np.ndarray:
+    """Move the nodes along the Fruchterman-Reingold forces, cooling as we go."""
+    n = len(pos)
+    # Ideal distance between nodes, for a layout in the unit square
+    k = 1.0 / np.sqrt(n)
+    pos = pos.copy()
+    for t in np.linspace(temperature, temperature / iterations, iterations):
+        if n <= EXACT_REPULSION_MAX_NODES:
+            displacement = _exact_repulsion(pos, k)
+        else:
+            displacement = _approximate_repulsion(pos, k)
+        # Attraction along edges
+        if len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            force = delta * np.linalg.norm(delta, axis=1, keepdims=True) / k
+            for axis in range(2):
+                displacement[:, axis] -= np.bincount(edges[:, 0], force[:, axis], minlength=n)
+                displacement[:, axis] += np.bincount(edges[:, 1], force[:, axis], minlength=n)
+        # A weak pull towards the centre, so disconnected parts don't drift apart
+        displacement -= k * (pos - pos.mean(axis=0))
+        # Limit each move to the temperature
+        length = np.maximum(np.linalg.norm(displacement, axis=1, keepdims=True), 1e-9)
+        pos += displacement / length * np.minimum(length, t)
+    return pos
+
+
+def _exact_repulsion(pos: np.ndarray, k: float) -> np.ndarray:
+    delta = pos[:, None, :] - pos[None, :, :]
+    distance_sq = np.maximum((delta ** 2).sum(axis=-1), 1e-9)
+    return k ** 2 * (delta / distance_sq[..., None]).sum(axis=1)
+
+
+def _approximate_repulsion(pos: np.ndarray, k: float) -> np.ndarray:
+    """
+    Barnes-Hut approximation of the repulsion between nodes.
+
+    The nodes are binned into a hierarchy of grids (a quadtree), each level halving the cell
+    size. At each level, a node is repelled by the cells that are near its cell at the level
+    above, but not adjacent to its own cell, treating each cell as a single mass at its
+    centre. Above the finest level, these cells are far enough away that the repulsion can be
+    computed once for each cell of the finest grid (at its centre), rather than for each node.
+    Nodes in adjacent cells of the finest grid repel each other exactly.
+    """
+    n = len(pos)
+    depth = max(int(np.ceil(np.log(n / NODES_PER_CELL) / np.log(4))), 1)
+    side = 2 ** depth
+    low = pos.min(axis=0)
+    cell_size = max(float((pos.max(axis=0) - low).max()), 1e-9) / side
+    cell_xy = np.minimum(((pos - low) / cell_size).astype(np.int64), side - 1)
+    cell = cell_xy[:, 0] * side + cell_xy[:, 1]
+    # The occupied cells of the finest grid, and the centre of the nodes in each
+    occupied, node_cell, counts = np.unique(cell, return_inverse=True, return_counts=True)
+    occupied_xy = np.stack([occupied // side, occupied % side], axis=1)
+    occupied_centre = _centres(node_cell, pos, counts)
+
+    displacement = np.zeros_like(pos)
+    cell_displacement = np.zeros_like(occupied_centre)
+    for level in range(2, depth + 1):
+        shift = depth - level
+        level_side = 2 ** level
+        level_cell = (occupied_xy[:, 0] >> shift) * level_side + (occupied_xy[:, 1] >> shift)
+        mass = np.bincount(level_cell, counts, minlength=level_side ** 2)
+        centre = _centres(level_cell, occupied_centre * counts[:, None], mass)
+        if level < depth:
+            cell_displacement += _far_repulsion(
+                occupied_centre, occupied_xy >> shift, level_side, mass, centre, k
+            )
+        else:
+            displacement += _far_repulsion(pos, cell_xy, level_side, mass, centre, k)
+    displacement += cell_displacement[node_cell]
+
+    # Exact repulsion from the nodes in the same and adjacent cells of the finest grid
+    order = np.argsort(cell, kind="stable")
+    cell_counts = np.bincount(cell, minlength=side ** 2)
+    starts = np.cumsum(cell_counts) - cell_counts
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            x = cell_xy[:, 0] + dx
+            y = cell_xy[:, 1] + dy
+            nodes = np.nonzero((x >= 0) & (x < side) & (y >= 0) & (y < side))[0]
+            other = x[nodes] * side + y[nodes]
+            # Pair each node with each of the nodes in the other cell
+            pair_counts = cell_counts[other]
+            i = np.repeat(nodes, pair_counts)
+            first = np.cumsum(pair_counts) - pair_counts
+            offsets = np.arange(len(i)) - np.repeat(first, pair_counts)
+            j = order[np.repeat(starts[other], pair_counts) + offsets]
+            distinct = i != j
+            i, j = i[distinct], j[distinct]
+            delta = pos[i] - pos[j]
+            distance_sq = np.maximum((delta ** 2).sum(axis=1), 1e-9)
+            force = k ** 2 * delta / distance_sq[:, None]
+            for axis in range(2):
+                displacement[:, axis] += np.bincount(i, force[:, axis], minlength=n)
+    return displacement
+
+
+def _centres(groups: np.ndarray, weighted_pos: np.ndarray, mass: np.ndarray) -> np.ndarray:
+    """The centres of mass of groups, given the positions of their members times their mass."""
+    totals = [np.bincount(groups, weighted_pos[:, axis], minlength=len(mass)) for axis in range(2)]
+    return np.stack(totals, axis=1) / np.maximum(mass, 1)[:, None]
+
+
+def _far_repulsion(points: np.ndarray, xy: np.ndarray, side: int, mass: np.ndarray,
+                   centre: np.ndarray, k: float) -> np.ndarray:
+    """Repulsion of points in cells `xy` of a grid by the cells near their parent cells."""
+    # The children of the cells adjacent to the parent cell, which aren't adjacent to the cell
+    x = (xy[:, :1] >> 1) * 2 + CHILD_OFFSETS[:, 0]
+    y = (xy[:, 1:] >> 1) * 2 + CHILD_OFFSETS[:, 1]
+    far = (np.abs(x - xy[:, :1]) > 1) | (np.abs(y - xy[:, 1:]) > 1)
+    valid = far & (x >= 0) & (x < side) & (y >= 0) & (y < side)
+    other = np.where(valid, x * side + y, 0)
+    delta_x = points[:, :1] - centre[other, 0]
+    delta_y = points[:, 1:] - centre[other, 1]
+    weight = np.where(valid, mass[other], 0) / np.maximum(delta_x ** 2 + delta_y ** 2, 1e-9)
+    force = np.stack([(delta_x * weight).sum(axis=1), (delta_y * weight).sum(axis=1)], axis=1)
+    return k ** 2 * force
+
+
+def _rescale(pos: np.ndarray, scale: float) -> np.ndarray:
+    """Centre the positions and scale them to fit in [-scale, scale], like networkx does."""
+    pos = pos - pos.mean(axis=0)
+    extent = np.abs(pos).max()
+    return pos * (scale / extent) if extent > 0 else pos
@@ -11,6 +11,7 @@ try:
     matplotlib.use('Agg')  # Use the Agg backend which doesn't require a GUI
     import matplotlib.pyplot as plt
     import networkx as nx
+    from tools.graph_layout import LAYOUT_ENGINES, compute_layout
     VISUALIZATION_AVAILABLE = True
 except ImportError:
     VISUALIZATION_AVAILABLE = False
@@ -41,6 +42,10 @@ class VisualizationSchema(BaseModel):
         default="visualizations",
         description="Directory to save the visualization image"
     )
+    layout: str = Field(
+        default="auto",
+        description="Layout engine for the concept map: 'auto' (chosen by graph size), 'circular', 'spring' or 'force_directed'"
+    )
 
 class VisualizationTool(Tool[str]):
     """
@@ -62,7 +67,8 @@ class VisualizationTool(Tool[str]):
     def run(self, ctx: ToolRunContext, 
             relationships: List[List[str]], 
             title: str,
-            output_dir: str) -> str:
+            output_dir: str,
+            layout: str = "auto") -> str:
         """
         Run the Visualization Tool to create a concept map.
         
@@ -71,6 +77,7 @@ class VisualizationTool(Tool[str]):
             relationships: List of relationships in format [source, target, relationship_type]
             title: Title for the visualization
             output_dir: Directory to save the visualization
+            layout: Layout engine to position the concepts with, or "auto" to pick one by graph size
             
         Returns:
             Path to the saved visualization file
@@ -86,6 +93,9 @@ class VisualizationTool(Tool[str]):
             if len(rel) < 3:
                 raise ToolRetryError(f"Error: Each relationship must have 3 elements [source, target, relationship_type]. Found: {rel}")
         
+        if layout != "auto" and layout not in LAYOUT_ENGINES:
+            raise ToolRetryError(f"Error: Unknown layout '{layout}'. Choose from: auto, {', '.join(LAYOUT_ENGINES)}")
+        
         # Convert relationships to tuples
         formatted_relationships = [(rel[0], rel[1], rel[2]) for rel in relationships]
         
@@ -95,9 +105,9 @@ class VisualizationTool(Tool[str]):
             concepts.add(source)
             concepts.add(target)
         
-        return self._create_concept_map(list(concepts), formatted_relationships, title, output_dir)
+        return self._create_concept_map(list(concepts), formatted_relationships, title, output_dir, layout)
     
-    def _create_concept_map(self, concepts: List[str], relationships: List[Tuple[str, str, str]], title: str, output_dir: str) -> str:
+    def _create_concept_map(self, concepts: List[str], relationships: List[Tuple[str, str, str]], title: str, output_dir: str, layout: str = "auto") -> str:
         """
         Create a network graph showing relationships between concepts using NetworkX.
         
@@ -111,6 +121,7 @@ class VisualizationTool(Tool[str]):
             relationships: List of (source, target, relationship_type) tuples
             title: Title for the visualization
             output_dir: Directory to save the visualization image
+            layout: Layout engine to position the concepts with, or "auto" to pick one by graph size
             
         Returns:
             Path to the saved visualization file or an error message
@@ -132,11 +143,8 @@ class VisualizationTool(Tool[str]):
             # Create the visualization with a larger figure size
             plt.figure(figsize=(24, 18))
             
-            # Choose layout based on graph size
-            if len(G.nodes) <= 10:
-                pos = nx.circular_layout(G, scale=2.0)
-            else:
-                pos = nx.spring_layout(G, k=2.0, iterations=100, seed=42, scale=2.0)
+            # Position the concepts (by default, with a layout chosen by graph size)
+            pos = compute_layout(G, layout, seed=42, scale=2.0)
             
             # Draw edges with visible arrows
             nx.draw_networkx_edges(